@@ -0,0 +1,413 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import re
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_CSRF_RE = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+@dataclass
+class Req:
+    name: str
+    method: str
+    path: str
+    form: list[tuple[str, str]] = field(default_factory=list)
+    files: list[tuple[str, str, bytes, str]] = field(default_factory=list)  # (field, filename, data, content-type)
+
+
+@dataclass
+class Resp:
+    status: int
+    headers: dict[str, str]  # 键为小写
+    body: bytes
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+
+def _encode(req: Req) -> tuple[bytes, str | None]:
+    if req.files:
+        boundary = "bench" + secrets.token_hex(12)
+        out = io.BytesIO()
+        for name, value in req.form:
+            out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode())
+            out.write(value.encode("utf-8") + b"\r\n")
+        for name, filename, data, ctype in req.files:
+            out.write(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f"Content-Type: {ctype}\r\n\r\n".encode()
+            )
+            out.write(data + b"\r\n")
+        out.write(f"--{boundary}--\r\n".encode())
+        return out.getvalue(), f"multipart/form-data; boundary={boundary}"
+    if req.method == "POST":
+        return urllib.parse.urlencode(req.form).encode(), "application/x-www-form-urlencoded"
+    return b"", None
+
+
+def _png(seed: int, size: tuple[int, int]) -> bytes:
+    from PIL import Image
+
+    buf = io.BytesIO()
+    color = (seed * 37 % 256, seed * 91 % 256, seed * 53 % 256)
+    Image.new("RGB", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _csrf(resp: Resp) -> str:
+    m = _CSRF_RE.search(resp.text)
+    return m.group(1) if m else ""
+
+
+# 单个虚拟用户的操作序列：注册/登录 -> 上传 -> 反复浏览（列表、搜索、翻页、预览、缩略图）-> 批量重新生成。
+# 以生成器描述，线程模型与 asyncio 模型共用同一份流程。
+def scenario(user_idx: int, args: argparse.Namespace):
+    username = f"bench_{user_idx}_{secrets.token_hex(3)}"
+    password = "bench-pass"
+
+    r = yield Req("auth.register_page", "GET", "/register")
+    yield Req("auth.register", "POST", "/register", form=[("username", username), ("password", password), ("csrf_token", _csrf(r))])
+    r = yield Req("auth.login_page", "GET", "/login")
+    form = [("username", username), ("password", password), ("csrf_token", _csrf(r)), ("next", "")]
+    yield Req("auth.login", "POST", "/login", form=form)
+
+    r = yield Req("images.index", "GET", "/images")
+    csrf = _csrf(r)
+    for i in range(args.uploads):
+        data = _png(user_idx * 1000 + i, (args.image_width, args.image_width * 3 // 4))
+        yield Req(
+            "images.upload",
+            "POST",
+            "/images/upload",
+            form=[("csrf_token", csrf), ("watermark_text", f"bench {user_idx} 仅供学习使用")],
+            files=[("image", f"bench-{i}.png", data, "image/png")],
+        )
+
+    r = yield Req("images.api_images", "GET", "/api/images?per_page=200")
+    ids = [int(x["id"]) for x in json.loads(r.text).get("images", [])] if r.status == 200 else []
+
+    for _ in range(args.iterations):
+        yield Req("images.index", "GET", "/images?page=1&per_page=20")
+        yield Req("images.index_search", "GET", "/images?q=" + urllib.parse.quote("学习使用"))
+        r = yield Req("images.api_images", "GET", "/api/images?per_page=5")
+        cursor = json.loads(r.text).get("next_cursor") if r.status == 200 else None
+        if cursor:
+            yield Req("images.api_images_cursor", "GET", f"/api/images?per_page=5&before_id={cursor}")
+        for image_id in ids[:3]:
+            yield Req("images.preview", "GET", f"/images/{image_id}/preview")
+            yield Req("images.thumb", "GET", f"/images/{image_id}/thumb?w=240")
+
+    if ids and args.regenerate:
+        form = [("csrf_token", csrf), ("action", "regenerate"), ("watermark_text", f"bench regen {user_idx}")]
+        form += [("image_ids", str(i)) for i in ids]
+        yield Req("images.bulk_regenerate", "POST", "/images/bulk", form=form)
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, name: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def _ok(req: Req, resp: Resp) -> bool:
+    # 表单提交成功时为 302；其余请求期望 200（或 304）
+    if resp.status >= 400 or (req.method == "GET" and resp.status == 302):
+        return False
+    # 注册/登录失败（含“服务器繁忙”）同样是 302 + flash：按跳转目标区分，
+    # 否则该用户后续请求全部被重定向到登录页，统计的就成了失败路径
+    location = urllib.parse.urlsplit(resp.headers.get("location", "")).path
+    if req.name == "auth.register":
+        return location == "/login"
+    if req.name == "auth.login":
+        return resp.status == 302 and location != "/login"
+    return True
+
+
+def _run_threads(base: str, args: argparse.Namespace, rec: Recorder) -> None:
+    import requests
+
+    def user(idx: int) -> None:
+        s = requests.Session()
+        gen = scenario(idx, args)
+        resp = None
+        try:
+            while True:
+                req = gen.send(resp)
+                body, ctype = _encode(req)
+                headers = {"Content-Type": ctype} if ctype else {}
+                t0 = time.perf_counter()
+                r = s.request(req.method, base + req.path, data=body or None, headers=headers, allow_redirects=False, timeout=60)
+                dt = time.perf_counter() - t0
+                resp = Resp(r.status_code, {k.lower(): v for k, v in r.headers.items()}, r.content)
+                rec.add(req.name, dt, _ok(req, resp))
+        except StopIteration:
+            pass
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(user, range(args.users)))
+
+
+class _AsyncHTTP:
+    # 最小的 HTTP/1.1 keep-alive 客户端（Content-Length / chunked），仅用于压测
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.cookies: dict[str, str] = {}
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    async def request(self, method: str, path: str, body: bytes, ctype: str | None) -> Resp:
+        if self._writer is None:
+            await self._connect()
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        if ctype:
+            head.append(f"Content-Type: {ctype}")
+        if self.cookies:
+            head.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookies.items()))
+        self._writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        status = int(status_line.split()[1])
+        headers: dict[str, str] = {}
+        while True:
+            line = (await self._reader.readline()).decode("latin-1").rstrip("\r\n")
+            if not line:
+                break
+            k, _, v = line.partition(":")
+            k, v = k.strip(), v.strip()
+            if k.lower() == "set-cookie":
+                name, _, rest = v.partition("=")
+                value = rest.split(";", 1)[0]
+                if "expires=thu, 01 jan 1970" in v.lower() or "max-age=0" in v.lower():
+                    self.cookies.pop(name, None)
+                else:
+                    self.cookies[name] = value
+            headers[k.lower()] = v
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            data = bytearray()
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                data += await self._reader.readexactly(size)
+                await self._reader.readline()
+            payload = bytes(data)
+        elif "content-length" in headers:
+            payload = await self._reader.readexactly(int(headers["content-length"]))
+        else:
+            payload = await self._reader.read()
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return Resp(status, headers, payload)
+
+
+def _run_asyncio(base: str, args: argparse.Namespace, rec: Recorder) -> None:
+    parsed = urllib.parse.urlsplit(base)
+
+    async def user(idx: int, sem: asyncio.Semaphore) -> None:
+        async with sem:
+            client = _AsyncHTTP(parsed.hostname, parsed.port or 80)
+            gen = scenario(idx, args)
+            resp = None
+            try:
+                while True:
+                    req = gen.send(resp)
+                    body, ctype = _encode(req)
+                    t0 = time.perf_counter()
+                    resp = await client.request(req.method, req.path, body, ctype)
+                    rec.add(req.name, time.perf_counter() - t0, _ok(req, resp))
+            except StopIteration:
+                pass
+            finally:
+                await client.close()
+
+    async def main() -> None:
+        sem = asyncio.Semaphore(args.concurrency)
+        await asyncio.gather(*(user(i, sem) for i in range(args.users)))
+
+    asyncio.run(main())
+
+
+def _start_server(args: argparse.Namespace, var_dir: Path):
+    # 临时 var/ 目录下启动完整应用（与生产相同的 waitress 服务器）
+    os.environ["VAR_DIR"] = str(var_dir)
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(16))
+    # 压测从同一 IP 注册/登录大量用户，默认关闭登录限流
+    if not args.keep_throttle:
+        os.environ["LOGIN_THROTTLE"] = "0"
+    # 默认的哈希并发上限（进程数 + 1）是按 waitress 4 线程设定的；压测时同时注册/登录的用户更多，
+    # 放宽到并发用户数，让请求排队等待哈希而不是直接返回“繁忙”
+    os.environ.setdefault("PASSWORD_HASH_QUEUE_DEPTH", str(max(1, args.concurrency)))
+    sys.path.insert(0, str(ROOT))
+    from waitress import create_server
+
+    from websec_app import create_app
+
+    app = create_app()
+    server = create_server(app, host="127.0.0.1", port=0, threads=args.server_threads)
+    thread = threading.Thread(target=server.run, name="bench-server", daemon=True)
+    thread.start()
+    return app, server, f"http://127.0.0.1:{server.effective_port}"
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # 最近秩法：第 ceil(p% * n) 个值
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def _summarize(rec: Recorder, elapsed: float) -> dict:
+    endpoints = {}
+    total = 0
+    for name, values in sorted(rec.samples.items()):
+        values = sorted(values)
+        total += len(values)
+        endpoints[name] = {
+            "count": len(values),
+            "errors": rec.errors.get(name, 0),
+            "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p50_ms": round(_percentile(values, 50) * 1000, 2),
+            "p95_ms": round(_percentile(values, 95) * 1000, 2),
+            "p99_ms": round(_percentile(values, 99) * 1000, 2),
+        }
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(rec.errors.values()),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+def _git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT), capture_output=True, text=True)
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def _compare(report: dict, baseline: dict, threshold: float) -> int:
+    # 与基线逐个 endpoint 比较 p95；任一 endpoint 变慢超过 threshold（百分比）时返回 1
+    regressed = 0
+    print(f"{'endpoint':32} {'base p95':>10} {'p95':>10} {'change':>8}", file=sys.stderr)
+    for name, cur in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or not base["p95_ms"]:
+            continue
+        change = (cur["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+        flag = " !" if change > threshold else ""
+        regressed += bool(flag)
+        print(f"{name:32} {base['p95_ms']:>10.2f} {cur['p95_ms']:>10.2f} {change:>7.1f}%{flag}", file=sys.stderr)
+    return 1 if regressed else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="WebSec Lab 压测：混合业务场景，输出各接口吞吐与 p50/p95/p99（JSON）")
+    parser.add_argument("--url", default="", help="压测已运行的服务（默认在临时 var/ 目录下自行启动）")
+    parser.add_argument("--model", choices=("threads", "asyncio"), default="threads", help="客户端并发模型")
+    parser.add_argument("--users", type=int, default=8, help="虚拟用户数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时运行的虚拟用户数")
+    parser.add_argument("--uploads", type=int, default=3, help="每个用户上传的图片数")
+    parser.add_argument("--iterations", type=int, default=5, help="每个用户浏览循环次数")
+    parser.add_argument("--image-width", type=int, default=1024)
+    parser.add_argument("--no-regenerate", dest="regenerate", action="store_false", help="跳过批量重新生成")
+    parser.add_argument("--server-threads", type=int, default=8, help="自行启动时 waitress 的线程数")
+    parser.add_argument("--keep-throttle", action="store_true", help="自行启动时保留登录限流")
+    parser.add_argument("--out", default="", help="结果 JSON 写入文件（默认输出到 stdout）")
+    parser.add_argument("--baseline", default="", help="与之前的结果 JSON 比较 p95")
+    parser.add_argument("--threshold", type=float, default=20.0, help="p95 变慢超过该百分比视为回归（默认 20）")
+    args = parser.parse_args(argv)
+
+    app = server = None
+    tmp = None
+    base = args.url.rstrip("/")
+    if not base:
+        tmp = tempfile.TemporaryDirectory(prefix="websec-bench-")
+        app, server, base = _start_server(args, Path(tmp.name) / "var")
+
+    rec = Recorder()
+    t0 = time.perf_counter()
+    try:
+        if args.model == "asyncio":
+            _run_asyncio(base, args, rec)
+        else:
+            _run_threads(base, args, rec)
+    finally:
+        elapsed = time.perf_counter() - t0
+        if server is not None:
+            server.close()
+            # 等待后台水印渲染结束后再删除临时目录
+            app.extensions["watermark_queue"].shutdown()
+        if tmp is not None:
+            tmp.cleanup()
+
+    report = {
+        "meta": {
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "model": args.model,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "uploads": args.uploads,
+            "iterations": args.iterations,
+            "server": "external" if args.url else f"waitress threads={args.server_threads}",
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        **_summarize(rec, elapsed),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    code = 0
+    if args.baseline:
+        code = _compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.threshold)
+    return code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -58,6 +58,8 @@ def cmd_setup(args: argparse.Namespace) -> int:
         return 1
     if _run([str(venv_python), "-m", "websec_app", "gen-cert"]) != 0:
         return 1
+    if _run([str(venv_python), "-m", "websec_app", "build-static"]) != 0:
+        return 1
     return 0
 
 
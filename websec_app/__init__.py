@@ -5,9 +5,23 @@ from pathlib import Path
 from flask import Flask, g, redirect, render_template, request, url_for
 from dotenv import load_dotenv
 
+from .assets import init_assets
+from .audit import init_audit_writer
+from .compress import init_compression
 from .config import AppConfig
-from .db import close_db, get_db, init_db_if_missing
+from .db import close_db, get_db, init_db_if_missing, init_db_pool
+from .ingest import IngestRequest
+from .jobs import init_watermark_queue
+from .metrics import init_metrics
+from .profiling import init_profiling
+from .passwords import init_password_hasher
+from .probes import init_probe_executor
+from .sandbox import init_lab_sandbox
 from .security import csrf_token, require_csrf
+from .sessions import init_sessions
+from .templating import init_templating
+from .throttle import init_login_throttle
+from .usercache import init_user_cache
 
 
 def create_app() -> Flask:
@@ -15,10 +29,26 @@ def create_app() -> Flask:
     cfg = AppConfig.load()
 
     app = Flask(__name__)
+    app.request_class = IngestRequest
     app.config.from_mapping(cfg.as_flask_config())
 
     cfg.ensure_dirs()
     init_db_if_missing(cfg.db_path)
+    init_db_pool(app)
+    init_audit_writer(app)
+    init_user_cache(app)
+    init_password_hasher(app)
+    init_login_throttle(app)
+    init_sessions(app)
+
+    init_watermark_queue(app)
+    init_probe_executor(app)
+    init_lab_sandbox(app)
+
+    # 最先注册：CSRF 校验失败等提前结束的请求也能按 endpoint 统计
+    init_metrics(app)
+    # 在指标中间件外层：压缩发生在响应体迭代时，不计入 app 耗时
+    init_compression(app)
 
     app.teardown_appcontext(close_db)
     app.before_request(require_csrf)
@@ -27,17 +57,31 @@ def create_app() -> Flask:
     def load_user() -> None:
         from .auth import get_current_user
 
+        # 静态文件不需要用户信息
+        if request.endpoint in ("static", "assets"):
+            g.user = None
+            return
         g.user = get_current_user()
 
+    # 需在 load_user 之后注册（按请求头剖析时要判断是否为管理员）
+    init_profiling(app)
+
     app.jinja_env.globals["csrf_token"] = csrf_token
+    # 已执行 build-static 时模板中的 url_for('static', ...) 输出带内容哈希的 /assets/ 地址
+    init_assets(app)
 
     from .auth import bp as auth_bp
     from .images import bp as images_bp
     from .labs import bp as labs_bp
+    from .profiling import bp as profiling_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(images_bp)
     app.register_blueprint(labs_bp)
+    app.register_blueprint(profiling_bp)
+
+    # 蓝图注册完成后才能列出全部模板
+    init_templating(app)
 
     @app.get("/")
     def index():
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import mimetypes
+from pathlib import Path
+
+from flask import abort, request, send_file, url_for
+
+from .compress import negotiate
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只生成 gzip
+    brotli = None
+
+MANIFEST_NAME = "manifest.json"
+# 文本类资源才预压缩；图片/字体本身已压缩
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".map", ".txt", ".html"}
+
+
+def _hashed_name(rel: str, digest: str) -> str:
+    path = Path(rel)
+    return str(path.with_name(f"{path.stem}.{digest[:12]}{path.suffix}").as_posix())
+
+
+def build_static(src_dir: Path, out_dir: Path) -> dict:
+    # 内容哈希命名 + gzip/brotli 预压缩 + manifest；文件名随内容变化，可以永久缓存
+    files: dict[str, dict] = {}
+    for path in sorted(p for p in src_dir.rglob("*") if p.is_file()):
+        rel = path.relative_to(src_dir).as_posix()
+        data = path.read_bytes()
+        hashed = _hashed_name(rel, hashlib.sha256(data).hexdigest())
+        target = out_dir / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        st = path.stat()
+        entry = {"path": hashed, "size": len(data), "mtime": int(st.st_mtime), "encodings": []}
+        if path.suffix.lower() in COMPRESSIBLE:
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                (out_dir / f"{hashed}.gz").write_bytes(gz)
+                entry["encodings"].append("gzip")
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    (out_dir / f"{hashed}.br").write_bytes(br)
+                    entry["encodings"].append("br")
+        files[rel] = entry
+
+    # 清理旧版本的产物
+    keep = {MANIFEST_NAME}
+    for entry in files.values():
+        keep.add(entry["path"])
+        keep.update(f"{entry['path']}.{ext}" for ext in ("gz", "br"))
+    for old in out_dir.rglob("*"):
+        if old.is_file() and old.relative_to(out_dir).as_posix() not in keep:
+            old.unlink()
+
+    manifest = {"files": files}
+    (out_dir / MANIFEST_NAME).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, src_dir: Path, out_dir: Path, files: dict[str, dict]) -> None:
+        self.src_dir = src_dir
+        self.out_dir = out_dir
+        self.files = files
+        self.by_hashed = {entry["path"]: entry for entry in files.values()}
+
+    @classmethod
+    def load(cls, src_dir: Path, out_dir: Path) -> "AssetManifest | None":
+        path = out_dir / MANIFEST_NAME
+        try:
+            files = json.loads(path.read_text(encoding="utf-8"))["files"]
+        except (OSError, ValueError, KeyError):
+            return None
+        # 源文件在构建之后改动过（或有新增）：manifest 已过期，退回 Flask 默认的 /static
+        sources = {p.relative_to(src_dir).as_posix(): p for p in src_dir.rglob("*") if p.is_file()}
+        if set(sources) != set(files):
+            return None
+        for rel, src in sources.items():
+            st = src.stat()
+            if st.st_size != files[rel]["size"] or int(st.st_mtime) != files[rel]["mtime"]:
+                return None
+        return cls(src_dir, out_dir, files)
+
+    def url_for(self, endpoint: str, **values) -> str:
+        if endpoint == "static":
+            entry = self.files.get(values.get("filename", ""))
+            if entry is not None:
+                values["filename"] = entry["path"]
+                endpoint = "assets"
+        return url_for(endpoint, **values)
+
+    def serve(self, filename: str):
+        entry = self.by_hashed.get(filename)
+        if entry is None:
+            abort(404)
+        # 与动态压缩相同的协商（尊重 q 值，如 gzip;q=0）；同等 q 值时优先 br
+        variants = {enc: ext for enc, ext in (("br", "br"), ("gzip", "gz")) if enc in entry["encodings"]}
+        encoding = negotiate(request.headers.get("Accept-Encoding", ""), variants)
+        path = self.out_dir / entry["path"]
+        if encoding:
+            path = self.out_dir / f"{entry['path']}.{variants[encoding]}"
+        mimetype = mimetypes.guess_type(entry["path"])[0] or "application/octet-stream"
+        resp = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=31536000)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        if entry["encodings"]:
+            resp.vary.add("Accept-Encoding")
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+        return resp
+
+
+def init_assets(app) -> AssetManifest | None:
+    src_dir = Path(app.static_folder)
+    out_dir = Path(app.config["STATIC_BUILD_DIR"])
+    if not app.config["STATIC_HASHED"] or not (out_dir / MANIFEST_NAME).exists():
+        return None
+    manifest = AssetManifest.load(src_dir, out_dir)
+    if manifest is None:
+        app.logger.warning("static manifest is out of date, serving /static directly (run: python -m websec_app build-static)")
+        return None
+    app.extensions["assets"] = manifest
+    app.jinja_env.globals["url_for"] = manifest.url_for
+    app.add_url_rule("/assets/<path:filename>", "assets", manifest.serve)
+    return manifest
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import atexit
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from flask import current_app
+
+from .db import _connect
+
+# 用户可能在事件落库前被删除：按子查询写入 user_id，删除后为 NULL（与 ON DELETE SET NULL 一致），
+# 避免外键失败导致整批回滚
+_INSERT_SQL = """
+INSERT INTO audit_logs (user_id, action, detail, ip, ua, created_at)
+VALUES ((SELECT id FROM users WHERE id = ?), ?, ?, ?, ?, ?)
+"""
+
+AuditEvent = tuple  # (user_id, action, detail, ip, ua, created_at)
+
+_COLUMNS = "id, user_id, action, detail, ip, ua, created_at"
+_VIEW_COLUMNS = "id, action, detail, ip, ua, created_at"
+_ARCHIVE_RE = re.compile(r"^audit_logs_(\d{6})$")
+
+# 保留期任务的执行间隔（由写入线程顺带执行）
+_ROTATE_INTERVAL = 24 * 3600
+
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone().isoformat(timespec="seconds")
+
+
+def archive_table(month: str) -> str:
+    # month 形如 2024-05 -> audit_logs_202405
+    name = "audit_logs_" + month.replace("-", "")
+    if not _ARCHIVE_RE.match(name):
+        raise ValueError(f"bad month: {month!r}")
+    return name
+
+
+def archive_tables(conn: sqlite3.Connection) -> list[str]:
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'audit_logs_%'").fetchall()
+    return sorted((r[0] for r in rows if _ARCHIVE_RE.match(r[0])), reverse=True)
+
+
+# 分区与保留：
+#   audit_logs            最近 hot_days 天的明细（在线查询）
+#   audit_logs_YYYYMM     超出 hot_days 的明细按月归档，同时按（天, 用户, 动作）汇总进 audit_daily
+#   超过 keep_months 个月的归档表整表删除，只保留 audit_daily 汇总
+def rotate_audit_logs(
+    conn: sqlite3.Connection,
+    *,
+    hot_days: int,
+    keep_months: int,
+    now: datetime | None = None,
+) -> dict:
+    now = now or datetime.now(timezone.utc)
+    cutoff = _iso(now - timedelta(days=max(1, int(hot_days))))
+    moved = 0
+    dropped: list[str] = []
+
+    with conn:
+        months = [
+            r[0]
+            for r in conn.execute(
+                "SELECT DISTINCT substr(created_at, 1, 7) FROM audit_logs WHERE created_at < ?", (cutoff,)
+            ).fetchall()
+        ]
+        for month in months:
+            table = archive_table(month)
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                  id INTEGER PRIMARY KEY,
+                  user_id INTEGER,
+                  action TEXT NOT NULL,
+                  detail TEXT NOT NULL DEFAULT '',
+                  ip TEXT NOT NULL DEFAULT '',
+                  ua TEXT NOT NULL DEFAULT '',
+                  created_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_id ON {table}(user_id, id)")
+            where = "created_at < ? AND substr(created_at, 1, 7) = ?"
+            conn.execute(
+                f"INSERT OR IGNORE INTO {table} ({_COLUMNS}) SELECT {_COLUMNS} FROM audit_logs WHERE {where}",
+                (cutoff, month),
+            )
+            conn.execute(
+                f"""
+                INSERT INTO audit_daily (day, user_id, action, n)
+                SELECT substr(created_at, 1, 10), COALESCE(user_id, 0), action, COUNT(1)
+                FROM audit_logs WHERE {where}
+                GROUP BY 1, 2, 3
+                ON CONFLICT(user_id, day, action) DO UPDATE SET n = n + excluded.n
+                """,
+                (cutoff, month),
+            )
+            moved += conn.execute(f"DELETE FROM audit_logs WHERE {where}", (cutoff, month)).rowcount
+
+        if keep_months > 0:
+            oldest = (now.astimezone().year * 12 + now.astimezone().month - 1) - int(keep_months)
+            oldest_key = f"{oldest // 12:04d}{oldest % 12 + 1:02d}"
+            for table in archive_tables(conn):
+                if _ARCHIVE_RE.match(table).group(1) <= oldest_key:
+                    conn.execute(f"DROP TABLE {table}")
+                    dropped.append(table)
+
+    return {"moved": moved, "archived_months": months, "dropped_tables": dropped}
+
+
+def query_audit(
+    conn: sqlite3.Connection,
+    user_id: int,
+    *,
+    action: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    before_id: int | None = None,
+    limit: int = 50,
+) -> list[dict]:
+    where = ["user_id = ?"]
+    params: list[object] = [user_id]
+    if action:
+        where.append("action = ?")
+        params.append(action)
+    if since:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until:
+        where.append("created_at < ?")
+        params.append(until)
+    if before_id:
+        where.append("id < ?")
+        params.append(before_id)
+    cond = " AND ".join(where)
+
+    # 归档表按月份裁剪：只查与时间范围重叠的月份
+    sources = ["audit_logs"]
+    for table in archive_tables(conn):
+        key = _ARCHIVE_RE.match(table).group(1)
+        if since and key < since[:7].replace("-", ""):
+            continue
+        if until and key > until[:7].replace("-", ""):
+            continue
+        sources.append(table)
+
+    parts = [f"SELECT * FROM (SELECT {_VIEW_COLUMNS} FROM {t} WHERE {cond} ORDER BY id DESC LIMIT ?)" for t in sources]
+    sql = " UNION ALL ".join(parts) + " ORDER BY id DESC LIMIT ?"
+    all_params = (params + [limit]) * len(sources) + [limit]
+    return [dict(r) for r in conn.execute(sql, tuple(all_params)).fetchall()]
+
+
+def forget_user_audit(conn: sqlite3.Connection, user_id: int) -> None:
+    # 与 audit_logs 的 ON DELETE SET NULL 保持一致：归档明细置空，汇总计入匿名（user_id = 0）
+    for table in archive_tables(conn):
+        conn.execute(f"UPDATE {table} SET user_id = NULL WHERE user_id = ?", (user_id,))
+    conn.execute(
+        """
+        INSERT INTO audit_daily (day, user_id, action, n)
+        SELECT day, 0, action, n FROM audit_daily WHERE user_id = ?
+        ON CONFLICT(user_id, day, action) DO UPDATE SET n = n + excluded.n
+        """,
+        (user_id,),
+    )
+    conn.execute("DELETE FROM audit_daily WHERE user_id = ?", (user_id,))
+
+
+class AuditWriter:
+    # 审计事件先进入有界内存队列，由后台线程按条数/时间阈值批量 executemany 写入，
+    # 请求线程不再为每条事件单独 commit。队列满时按 overflow 策略处理：
+    #   block：最多等待 block_ms，仍满则在当前线程同步写入（不丢事件，形成背压）
+    #   drop：直接丢弃并计数
+    def __init__(
+        self,
+        db_path: Path,
+        *,
+        batch_size: int = 200,
+        flush_ms: int = 500,
+        max_queue: int = 10000,
+        overflow: str = "block",
+        block_ms: int = 50,
+        hot_days: int = 0,
+        keep_months: int = 0,
+    ) -> None:
+        self.db_path = db_path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(1, int(flush_ms)) / 1000
+        self.overflow = overflow if overflow in ("block", "drop") else "block"
+        self.block_timeout = max(0, int(block_ms)) / 1000
+        self._queue: queue.Queue[AuditEvent] = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._write_lock = threading.Lock()
+        # 取出与写入之间持有：flush() 返回时，之前取出的批次（包括后台线程正在写的）都已落库
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._conn: sqlite3.Connection | None = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.sync_writes = 0
+        self.batches = 0
+        self.errors = 0
+        # hot_days > 0 时写入线程每天执行一次 rotate_audit_logs
+        self.hot_days = int(hot_days)
+        self.keep_months = int(keep_months)
+        # monotonic() 从开机计时：用 -inf 保证启动后立即执行一次，之后每天一次
+        self._last_rotate = float("-inf")
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "sync_writes": self.sync_writes,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+    def submit(self, event: AuditEvent) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            if self.overflow == "drop":
+                self.dropped += 1
+                return
+            self.blocked += 1
+            self._flush_requested.set()
+            try:
+                self._queue.put(event, timeout=self.block_timeout)
+            except queue.Full:
+                self.sync_writes += 1
+                self._write([event])
+                return
+        self.enqueued += 1
+        if self._queue.qsize() >= self.batch_size:
+            self._flush_requested.set()
+
+    def _drain(self) -> list[AuditEvent]:
+        events: list[AuditEvent] = []
+        while len(events) < self.batch_size:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _write(self, events: list[AuditEvent]) -> None:
+        if not events:
+            return
+        with self._write_lock:
+            try:
+                if self._conn is None:
+                    self._conn = _connect(str(self.db_path))
+                with self._conn:
+                    self._conn.executemany(_INSERT_SQL, events)
+                self.written += len(events)
+                self.batches += 1
+            except sqlite3.Error:
+                self.errors += 1
+                self.dropped += len(events)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            while True:
+                events = self._drain()
+                if not events:
+                    return
+                self._write(events)
+
+    def _rotate(self) -> None:
+        with self._write_lock:
+            try:
+                if self._conn is None:
+                    self._conn = _connect(str(self.db_path))
+                rotate_audit_logs(self._conn, hot_days=self.hot_days, keep_months=self.keep_months)
+            except sqlite3.Error:
+                self.errors += 1
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+            if self.hot_days > 0 and time.monotonic() - self._last_rotate >= _ROTATE_INTERVAL:
+                self._last_rotate = time.monotonic()
+                self._rotate()
+
+    def shutdown(self) -> None:
+        self._stopping.set()
+        self._flush_requested.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+        # 保证退出前队列中的事件全部落库
+        self.flush()
+        with self._write_lock:
+            conn, self._conn = self._conn, None
+            if conn is not None:
+                conn.close()
+
+
+def init_audit_writer(app) -> AuditWriter | None:
+    if not app.config["AUDIT_ASYNC"]:
+        return None
+    writer = AuditWriter(
+        Path(app.config["DB_PATH"]),
+        batch_size=app.config["AUDIT_BATCH_SIZE"],
+        flush_ms=app.config["AUDIT_FLUSH_MS"],
+        max_queue=app.config["AUDIT_QUEUE_SIZE"],
+        overflow=app.config["AUDIT_OVERFLOW"],
+        hot_days=app.config["AUDIT_HOT_DAYS"],
+        keep_months=app.config["AUDIT_KEEP_MONTHS"],
+    )
+    app.extensions["audit_writer"] = writer
+    writer.start()
+    atexit.register(writer.shutdown)
+    return writer
+
+
+def flush_audit() -> None:
+    # 查看审计记录前先把本进程尚未落库的事件写入，保证“刚做的操作”能看到；
+    # 队列为空时也要调用：后台线程可能刚取出一批还没写完，flush() 会等它写完
+    writer = current_app.extensions.get("audit_writer")
+    if writer is not None:
+        writer.flush()
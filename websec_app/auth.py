@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import math
+from datetime import datetime
 from functools import wraps
 from pathlib import Path
 
@@ -8,45 +10,58 @@ from flask import (
     current_app,
     flash,
     g,
+    make_response,
     redirect,
     render_template,
     request,
     session,
     url_for,
 )
+from markupsafe import Markup
 
+from .audit import flush_audit, forget_user_audit, query_audit
 from .db import fetch_many, fetch_one, get_db, log_action
-from .security import hash_password, set_session_logged_in, verify_password
+from .passwords import HashingBusy
+from .security import hash_password, password_needs_rehash, reset_session, set_session_logged_in, verify_password
+from .sessions import revoke_user_sessions
+from .storage import collect_garbage
+from .templating import cached_fragment, fragment_key
+from .throttle import get_login_throttle
+from .usercache import get_user_cache
 
 bp = Blueprint("auth", __name__)
 
 
-def _cleanup_user_image_files(user_id: int) -> None:
-    upload_dir = Path(current_app.config["UPLOAD_DIR"])
-    watermarked_dir = Path(current_app.config["WATERMARKED_DIR"])
+def _user_image_files(user_id: int) -> list[dict]:
+    return fetch_many("SELECT stored_name, watermarked_name FROM images WHERE user_id = ?", (user_id,))
 
-    rows = fetch_many("SELECT stored_name, watermarked_name FROM images WHERE user_id = ?", (user_id,))
-    for r in rows:
-        try:
-            (upload_dir / r["stored_name"]).unlink(missing_ok=True)
-        except Exception:
-            pass
-        try:
-            (watermarked_dir / r["watermarked_name"]).unlink(missing_ok=True)
-        except Exception:
-            pass
 
+def _cleanup_user_image_files(rows: list[dict]) -> None:
+    # 用户删除（级联删除 images）之后调用：只删除已无其他记录引用的文件
+    collect_garbage(
+        get_db(),
+        Path(current_app.config["UPLOAD_DIR"]),
+        Path(current_app.config["WATERMARKED_DIR"]),
+        thumb_dir=Path(current_app.config["THUMB_DIR"]),
+        stored_names=[r["stored_name"] for r in rows],
+        watermarked_names=[r["watermarked_name"] for r in rows],
+    )
 
-def get_current_user() -> dict | None:
-    user_id = session.get("user_id")
-    if not user_id:
-        return None
+
+def _load_user(user_id: int) -> dict | None:
     return fetch_one(
         "SELECT id, username, is_admin, display_name, description FROM users WHERE id = ?",
         (user_id,),
     )
 
 
+def get_current_user() -> dict | None:
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    return get_user_cache().get(int(user_id), _load_user)
+
+
 def login_required(view):
     @wraps(view)
     def wrapped(*args, **kwargs):
@@ -91,12 +106,18 @@ def register_post():
     count_row = fetch_one("SELECT COUNT(1) AS c FROM users")
     is_admin = 1 if int((count_row or {}).get("c", 0)) == 0 else 0
 
+    try:
+        password_hash = hash_password(password)
+    except HashingBusy:
+        flash("服务器繁忙，请稍后重试", "warning")
+        return redirect(url_for("auth.register"))
+
     get_db().execute(
         """
         INSERT INTO users (username, password_hash, is_admin, display_name, description, created_at, updated_at)
         VALUES (?, ?, ?, '', '', datetime('now'), datetime('now'))
         """,
-        (username, hash_password(password), is_admin),
+        (username, password_hash, is_admin),
     )
     get_db().commit()
     user = fetch_one("SELECT id FROM users WHERE username = ?", (username,))
@@ -116,12 +137,40 @@ def login_post():
     password = request.form.get("password") or ""
     next_url = request.form.get("next") or ""
 
+    # 超出频率限制的请求在查库、校验密码、写审计日志之前直接拒绝
+    throttle = get_login_throttle()
+    if throttle is not None:
+        wait = throttle.check(request.remote_addr or "", username)
+        if wait:
+            flash("登录尝试过于频繁，请稍后再试", "danger")
+            resp = make_response(render_template("login.html", next=next_url), 429)
+            resp.headers["Retry-After"] = str(max(1, math.ceil(min(wait, 3600))))
+            return resp
+
     user_row = fetch_one("SELECT id, username, password_hash FROM users WHERE username = ?", (username,))
-    if not user_row or not verify_password(user_row["password_hash"], password):
+    try:
+        ok = bool(user_row) and verify_password(user_row["password_hash"], password)
+    except HashingBusy:
+        flash("登录请求过多，请稍后重试", "warning")
+        return redirect(url_for("auth.login"))
+    if not ok:
         log_action(None, "login_failed", f"username={username}")
         flash("用户名或密码错误", "danger")
         return redirect(url_for("auth.login"))
 
+    # 哈希参数（算法/迭代次数）调整后，用户下次登录时用明文密码重新生成哈希
+    if password_needs_rehash(user_row["password_hash"]):
+        try:
+            get_db().execute(
+                "UPDATE users SET password_hash = ?, updated_at = datetime('now') WHERE id = ?",
+                (hash_password(password), user_row["id"]),
+            )
+            get_db().commit()
+        except HashingBusy:
+            pass
+
+    if throttle is not None:
+        throttle.succeeded(username)
     set_session_logged_in(int(user_row["id"]))
     log_action(int(user_row["id"]), "login", f"username={username}")
     flash("登录成功", "success")
@@ -135,7 +184,7 @@ def login_post():
 @login_required
 def logout():
     user_id = g.user["id"]
-    session.clear()
+    reset_session()
     log_action(user_id, "logout", "")
     flash("已登出", "info")
     return redirect(url_for("index"))
@@ -158,6 +207,7 @@ def profile_post():
         (display_name, description, g.user["id"]),
     )
     get_db().commit()
+    get_user_cache().invalidate(g.user["id"])
     log_action(g.user["id"], "profile_update", "")
     flash("已保存", "success")
     return redirect(url_for("auth.profile"))
@@ -172,10 +222,14 @@ def account_delete():
         return redirect(url_for("auth.profile"))
 
     uid = g.user["id"]
-    _cleanup_user_image_files(uid)
-    session.clear()
+    files = _user_image_files(uid)
+    reset_session()
     get_db().execute("DELETE FROM users WHERE id = ?", (uid,))
+    forget_user_audit(get_db(), uid)
     get_db().commit()
+    get_user_cache().invalidate(uid)
+    revoke_user_sessions(uid)
+    _cleanup_user_image_files(files)
     log_action(None, "account_deleted", f"user_id={uid}")
     flash("账号已删除", "info")
     return redirect(url_for("index"))
@@ -200,29 +254,74 @@ def user_delete(user_id: int):
         flash("用户不存在", "warning")
         return redirect(url_for("auth.users"))
 
-    _cleanup_user_image_files(int(user_id))
+    files = _user_image_files(int(user_id))
     get_db().execute("DELETE FROM users WHERE id = ?", (user_id,))
+    forget_user_audit(get_db(), int(user_id))
     get_db().commit()
+    get_user_cache().invalidate(int(user_id))
+    # 被删除用户的所有会话立即失效，不必等待过期
+    revoke_user_sessions(int(user_id))
+    _cleanup_user_image_files(files)
     log_action(g.user["id"], "user_delete", f"target_id={user_id} username={target['username']}")
     flash("已删除用户", "info")
     return redirect(url_for("auth.users"))
 
 
+def _time_arg(name: str) -> str | None:
+    # 接受日期（2024-05-01）或带时区的 ISO 时间；统一换算为与 created_at 相同的本地时区格式
+    raw = (request.args.get(name) or "").strip()
+    if not raw:
+        return None
+    dt = datetime.fromisoformat(raw)
+    if len(raw) == 10:
+        return raw
+    return dt.astimezone().isoformat(timespec="seconds")
+
+
 @bp.get("/audit")
 @login_required
 def audit():
-    rows = fetch_many(
-        "SELECT id, action, detail, ip, ua, created_at FROM audit_logs WHERE user_id = ? ORDER BY id DESC LIMIT 200",
-        (g.user["id"],),
-    )
-    return render_template("audit.html", logs=rows)
+    def render():
+        flush_audit()
+        rows = query_audit(get_db(), g.user["id"], limit=200)
+        return Markup(render_template("_audit_table.html", logs=rows)), True
+
+    audit_table = cached_fragment(fragment_key("audit", g.user["id"]), render)
+    return render_template("audit.html", audit_table=audit_table)
 
 
 @bp.get("/api/audit")
 @login_required
 def api_audit():
+    flush_audit()
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 50), 200))
+        before_id = max(0, int(request.args.get("before_id") or 0))
+        since, until = _time_arg("since"), _time_arg("until")
+    except ValueError:
+        return {"error": "invalid limit/before_id/since/until"}, 400
+    rows = query_audit(
+        get_db(),
+        g.user["id"],
+        action=(request.args.get("action") or "").strip() or None,
+        since=since,
+        until=until,
+        before_id=before_id or None,
+        limit=limit,
+    )
+    return {
+        "logs": rows,
+        # 下一页：?before_id=next_cursor（其余筛选参数保持不变）
+        "next_cursor": rows[-1]["id"] if len(rows) == limit else None,
+    }
+
+
+@bp.get("/api/audit/daily")
+@login_required
+def api_audit_daily():
+    # 超出在线保留期的记录只保留按天汇总
     rows = fetch_many(
-        "SELECT id, action, detail, ip, ua, created_at FROM audit_logs WHERE user_id = ? ORDER BY id DESC LIMIT 50",
+        "SELECT day, action, n FROM audit_daily WHERE user_id = ? ORDER BY day DESC, action LIMIT 1000",
         (g.user["id"],),
     )
-    return {"logs": rows}
+    return {"daily": rows}
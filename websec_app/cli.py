@@ -2,12 +2,15 @@ from __future__ import annotations
 
 import argparse
 import sys
+from pathlib import Path
 
 from waitress import serve
 
 from . import create_app
+from .assets import build_static
+from .audit import rotate_audit_logs
 from .config import AppConfig
-from .db import init_db
+from .db import _connect, init_db
 from .security import generate_self_signed_cert
 
 
@@ -42,6 +45,35 @@ def _cmd_self_check(_args: argparse.Namespace) -> int:
     return 0
 
 
+def _cmd_audit_rotate(args: argparse.Namespace) -> int:
+    cfg = AppConfig.load()
+    cfg.ensure_dirs()
+    init_db(cfg.db_path)
+    conn = _connect(str(cfg.db_path))
+    try:
+        result = rotate_audit_logs(
+            conn,
+            hot_days=int(args.hot_days if args.hot_days is not None else cfg.audit_hot_days),
+            keep_months=int(args.keep_months if args.keep_months is not None else cfg.audit_keep_months),
+        )
+    finally:
+        conn.close()
+    print("moved:", result["moved"])
+    print("archived months:", ", ".join(result["archived_months"]) or "-")
+    print("dropped tables:", ", ".join(result["dropped_tables"]) or "-")
+    return 0
+
+
+def _cmd_build_static(_args: argparse.Namespace) -> int:
+    cfg = AppConfig.load()
+    src = Path(__file__).resolve().parent / "static"
+    manifest = build_static(src, cfg.static_build_dir)
+    for rel, entry in manifest["files"].items():
+        print(f"{rel} -> {entry['path']} ({entry['size']} B; {', '.join(entry['encodings']) or '-'})")
+    print("manifest:", cfg.static_build_dir / "manifest.json")
+    return 0
+
+
 def _cmd_run(args: argparse.Namespace) -> int:
     cfg = AppConfig.load()
     cfg.ensure_dirs()
@@ -78,6 +110,14 @@ def main(argv: list[str] | None = None) -> int:
     p_check = sub.add_parser("self-check", help="本地自检（目录/数据库/证书）")
     p_check.set_defaults(func=_cmd_self_check)
 
+    p_rotate = sub.add_parser("audit-rotate", help="审计日志归档：超出保留期的明细按月归档并按天汇总")
+    p_rotate.add_argument("--hot-days", type=int, default=None, help="在线保留天数（默认 AUDIT_HOT_DAYS）")
+    p_rotate.add_argument("--keep-months", type=int, default=None, help="归档保留月数，0 为永久（默认 AUDIT_KEEP_MONTHS）")
+    p_rotate.set_defaults(func=_cmd_audit_rotate)
+
+    p_static = sub.add_parser("build-static", help="静态资源构建：内容哈希命名 + gzip/brotli 预压缩 + manifest")
+    p_static.set_defaults(func=_cmd_build_static)
+
     p_run = sub.add_parser("run", help="启动服务")
     p_run.add_argument("--host", default="127.0.0.1")
     p_run.add_argument("--port", default="5000")
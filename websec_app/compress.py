@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import zlib
+from collections.abc import Iterable
+
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+# 只压缩文本类响应；图片等本身已压缩，SSE 需要逐条送达，不能进压缩缓冲
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/csv",
+    "text/xml",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+class _Gzip:
+    def __init__(self, level: int) -> None:
+        self._obj = zlib.compressobj(max(1, min(9, level)), zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._obj.compress(data)
+        return out + self._obj.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+class _Brotli:
+    def __init__(self, level: int) -> None:
+        self._obj = brotli.Compressor(quality=max(0, min(11, level)))
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._obj.process(data)
+        return out + self._obj.flush() if flush else out
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int) -> None:
+        self._obj = zstandard.ZstdCompressor(level=max(1, min(19, level))).compressobj()
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._obj.compress(data)
+        return out + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else out
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+def available_encoders() -> dict[str, type]:
+    # 服务端偏好顺序：br > zstd > gzip（客户端 q 值相同时）
+    encoders: dict[str, type] = {}
+    if brotli is not None:
+        encoders["br"] = _Brotli
+    if zstandard is not None:
+        encoders["zstd"] = _Zstd
+    encoders["gzip"] = _Gzip
+    return encoders
+
+
+def negotiate(accept_encoding: str, encoders: Iterable[str]) -> str | None:
+    # encoders 按服务端偏好排序（可直接传 dict，按键迭代）
+    q: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        q[name] = weight
+    best, best_q = None, 0.0
+    for name in encoders:
+        weight = q.get(name, q.get("*", 0.0))
+        if weight > best_q:
+            best, best_q = name, weight
+    return best
+
+
+class CompressionMiddleware:
+    # 按 Accept-Encoding 协商 br/zstd/gzip，边迭代响应体边压缩。
+    # 不需要压缩的响应（类型不符、已有 Content-Encoding、太小、X-Sendfile 等）原样返回响应体迭代器，
+    # send_file 的 wsgi.file_wrapper 因此仍由 waitress 直接发送。
+    def __init__(self, wsgi_app, *, min_size: int = 1024, level: int = 6) -> None:
+        self.wsgi_app = wsgi_app
+        self.min_size = max(0, int(min_size))
+        self.level = int(level)
+        self.encoders = available_encoders()
+
+    def _should_compress(self, status: str, headers: list[tuple[str, str]]) -> bool:
+        code = int(status.split(" ", 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        h = {k.lower(): v for k, v in headers}
+        if "content-encoding" in h or "content-range" in h:
+            return False
+        if "x-sendfile" in h or "x-accel-redirect" in h:
+            return False
+        if "no-transform" in h.get("cache-control", "").lower():
+            return False
+        mimetype = h.get("content-type", "").split(";", 1)[0].strip().lower()
+        if mimetype not in COMPRESSIBLE_TYPES:
+            return False
+        length = h.get("content-length")
+        return length is None or int(length) >= self.min_size
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""), self.encoders)
+        if encoding is None or environ.get("REQUEST_METHOD") == "HEAD":
+            return self.wsgi_app(environ, start_response)
+
+        state: dict = {}
+
+        def _start_response(status, headers, exc_info=None):
+            if self._should_compress(status, headers):
+                state["pending"] = (status, list(headers), exc_info)
+                state["streamed"] = not any(k.lower() == "content-length" for k, _ in headers)
+                return state.setdefault("buffer", []).append
+            state.pop("pending", None)
+            return start_response(status, headers, exc_info)
+
+        body = self.wsgi_app(environ, _start_response)
+        if "pending" not in state:
+            return body
+        # 未开始迭代就被关闭（客户端断开）时也要关闭原响应体
+        close = getattr(body, "close", None)
+        return ClosingIterator(self._compressed(body, state, encoding, start_response), close and [close])
+
+    def _compressed(self, body, state, encoding: str, start_response):
+        status, headers, exc_info = state["pending"]
+        streamed = state["streamed"]
+        it = iter(body)
+        head = list(state.get("buffer", []))
+        size = sum(len(c) for c in head)
+        # 长度未知的响应：先攒到 min_size 再决定是否压缩
+        exhausted = False
+        while size < self.min_size:
+            try:
+                chunk = next(it)
+            except StopIteration:
+                exhausted = True
+                break
+            head.append(chunk)
+            size += len(chunk)
+
+        if exhausted and size < self.min_size:
+            if streamed:
+                headers.append(("Content-Length", str(size)))
+            start_response(status, headers, exc_info)
+            yield from head
+            return
+
+        out_headers = []
+        vary = []
+        for k, v in headers:
+            lk = k.lower()
+            if lk in ("content-length", "accept-ranges"):
+                continue
+            if lk == "vary":
+                vary.append(v)
+                continue
+            if lk == "etag" and not v.startswith("W/"):
+                v = "W/" + v
+            out_headers.append((k, v))
+        vary_values = {x.strip().lower() for v in vary for x in v.split(",")}
+        if "accept-encoding" not in vary_values:
+            vary.append("Accept-Encoding")
+        out_headers.append(("Vary", ", ".join(vary)))
+        out_headers.append(("Content-Encoding", encoding))
+        start_response(status, out_headers, exc_info)
+
+        encoder = self.encoders[encoding](self.level)
+        data = encoder.compress(b"".join(head), streamed)
+        if data:
+            yield data
+        for chunk in it:
+            data = encoder.compress(chunk, streamed)
+            if data:
+                yield data
+        yield encoder.finish()
+
+
+def init_compression(app) -> None:
+    if not app.config["COMPRESS"]:
+        return
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=app.config["COMPRESS_MIN_SIZE"],
+        level=app.config["COMPRESS_LEVEL"],
+    )
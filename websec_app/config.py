@@ -17,24 +17,146 @@ class AppConfig:
     db_path: Path
     upload_dir: Path
     watermarked_dir: Path
+    thumb_dir: Path
     cert_dir: Path
     cert_crt_path: Path
     cert_key_path: Path
     session_minutes: int
+    watermark_workers: int
+    watermark_queue_depth: int
+    upload_max_bytes: int
+    upload_max_pixels: int
+    file_offload: str
+    file_offload_prefix: str
+    db_pool_size: int
+    db_busy_timeout_ms: int
+    db_cache_kb: int
+    db_mmap_mb: int
+    audit_async: bool
+    audit_batch_size: int
+    audit_flush_ms: int
+    audit_queue_size: int
+    audit_overflow: str
+    audit_hot_days: int
+    audit_keep_months: int
+    user_cache_size: int
+    user_cache_ttl: float
+    password_hash_method: str
+    password_salt_length: int
+    password_hash_workers: int
+    password_hash_queue_depth: int
+    login_throttle: bool
+    login_ip_burst: int
+    login_ip_per_minute: float
+    login_user_burst: int
+    login_user_per_minute: float
+    login_throttle_persist: bool
+    session_backend: str
+    session_max_entries: int
+    metrics_token: str
+    profile_dir: Path
+    profile_sample_ms: int
+    profile_keep: int
+    profile_max_active: int
+    probe_max_concurrent: int
+    probe_queue_depth: int
+    probe_per_user: int
+    probe_timeout: float
+    probe_max_output: int
+    probe_cache_seconds: float
+    probe_max_streams: int
+    lab_sql_max_steps: int
+    lab_sql_timeout_ms: int
+    lab_sql_max_rows: int
+    lab_sql_recycle: int
+    lab_sql_snapshot_seconds: float
+    static_build_dir: Path
+    static_hashed: bool
+    compress: bool
+    compress_min_size: int
+    compress_level: int
+    template_cache_dir: Path
+    fragment_cache_size: int
+    fragment_cache_ttl: float
 
     @staticmethod
     def load() -> "AppConfig":
         root = _root_dir()
-        var_dir = root / "var"
+        # VAR_DIR：数据目录（数据库、上传文件等），默认为仓库下的 var/
+        var_dir = Path(os.getenv("VAR_DIR") or root / "var")
         db_path = var_dir / "app.db"
         upload_dir = var_dir / "uploads"
         watermarked_dir = var_dir / "watermarked"
+        thumb_dir = var_dir / "thumbs"
         cert_dir = var_dir / "certs"
         cert_crt_path = cert_dir / "localhost.crt"
         cert_key_path = cert_dir / "localhost.key"
 
         secret_key = os.getenv("SECRET_KEY", "dev-only-secret-key-change-me")
         session_minutes = int(os.getenv("SESSION_MINUTES", "60"))
+        watermark_workers = int(os.getenv("WATERMARK_WORKERS", "2"))
+        watermark_queue_depth = int(os.getenv("WATERMARK_QUEUE_DEPTH", "64"))
+        upload_max_bytes = int(os.getenv("UPLOAD_MAX_MB", "20")) * 1024 * 1024
+        upload_max_pixels = int(os.getenv("UPLOAD_MAX_PIXELS", "40000000"))
+        # 图片文件交给前置服务器发送：""（不启用）/ x-accel-redirect（nginx）/ x-sendfile（Apache/lighttpd）
+        file_offload = os.getenv("FILE_OFFLOAD", "").strip().lower()
+        file_offload_prefix = os.getenv("FILE_OFFLOAD_PREFIX", "/_protected").rstrip("/")
+        db_pool_size = int(os.getenv("DB_POOL_SIZE", "8"))
+        db_busy_timeout_ms = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+        db_cache_kb = int(os.getenv("DB_CACHE_KB", "8192"))
+        db_mmap_mb = int(os.getenv("DB_MMAP_MB", "64"))
+        audit_async = os.getenv("AUDIT_ASYNC", "1").strip().lower() not in ("0", "false", "no", "")
+        audit_batch_size = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+        audit_flush_ms = int(os.getenv("AUDIT_FLUSH_MS", "500"))
+        audit_queue_size = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+        # 队列满时：block（短暂等待后同步写入）/ drop（丢弃并计数）
+        audit_overflow = os.getenv("AUDIT_OVERFLOW", "block").strip().lower()
+        audit_hot_days = int(os.getenv("AUDIT_HOT_DAYS", "90"))
+        audit_keep_months = int(os.getenv("AUDIT_KEEP_MONTHS", "12"))
+        user_cache_size = int(os.getenv("USER_CACHE_SIZE", "1024"))
+        user_cache_ttl = float(os.getenv("USER_CACHE_TTL", "30"))
+        # werkzeug 的 method 字符串：scrypt[:n:r:p] 或 pbkdf2[:hash[:iterations]]
+        password_hash_method = os.getenv("PASSWORD_HASH_METHOD", "scrypt").strip()
+        password_salt_length = int(os.getenv("PASSWORD_SALT_LENGTH", "16"))
+        password_hash_workers = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+        # 同时进行中（计算中 + 排队）的哈希任务上限；调用方的请求线程会一直等到结果返回，必须小于 waitress 的 4 个工作线程。
+        # 0 表示进程数 + 1（留一个排队位，登录并发略高于进程数时等待而不是直接报繁忙）
+        password_hash_queue_depth = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", "0"))
+        login_throttle = os.getenv("LOGIN_THROTTLE", "1").strip().lower() not in ("0", "false", "no", "")
+        login_ip_burst = int(os.getenv("LOGIN_IP_BURST", "20"))
+        login_ip_per_minute = float(os.getenv("LOGIN_IP_PER_MINUTE", "10"))
+        login_user_burst = int(os.getenv("LOGIN_USER_BURST", "5"))
+        login_user_per_minute = float(os.getenv("LOGIN_USER_PER_MINUTE", "2"))
+        login_throttle_persist = os.getenv("LOGIN_THROTTLE_PERSIST", "0").strip().lower() in ("1", "true", "yes")
+        # 会话存储：sqlite（默认）/ memory（进程内 LRU）/ cookie（Flask 签名 cookie）
+        session_backend = os.getenv("SESSION_BACKEND", "sqlite").strip().lower()
+        session_max_entries = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+        metrics_token = os.getenv("METRICS_TOKEN", "").strip()
+        profile_dir = var_dir / "profiles"
+        profile_sample_ms = int(os.getenv("PROFILE_SAMPLE_MS", "5"))
+        profile_keep = int(os.getenv("PROFILE_KEEP", "200"))
+        profile_max_active = int(os.getenv("PROFILE_MAX_ACTIVE", "2"))
+        probe_max_concurrent = int(os.getenv("PROBE_MAX_CONCURRENT", "4"))
+        probe_queue_depth = int(os.getenv("PROBE_QUEUE_DEPTH", "16"))
+        probe_per_user = int(os.getenv("PROBE_PER_USER", "2"))
+        probe_timeout = float(os.getenv("PROBE_TIMEOUT", "4"))
+        probe_max_output = int(os.getenv("PROBE_MAX_OUTPUT", "4000"))
+        probe_cache_seconds = float(os.getenv("PROBE_CACHE_SECONDS", "30"))
+        # waitress 默认 4 个工作线程，保持连接的输出流不超过一半
+        probe_max_streams = int(os.getenv("PROBE_MAX_STREAMS", "2"))
+        lab_sql_max_steps = int(os.getenv("LAB_SQL_MAX_STEPS", "2000000"))
+        lab_sql_timeout_ms = int(os.getenv("LAB_SQL_TIMEOUT_MS", "500"))
+        lab_sql_max_rows = int(os.getenv("LAB_SQL_MAX_ROWS", "200"))
+        lab_sql_recycle = int(os.getenv("LAB_SQL_RECYCLE", "100"))
+        lab_sql_snapshot_seconds = float(os.getenv("LAB_SQL_SNAPSHOT_SECONDS", "300"))
+        static_build_dir = var_dir / "static"
+        static_hashed = os.getenv("STATIC_HASHED", "1").strip().lower() not in ("0", "false", "no", "")
+        compress = os.getenv("COMPRESS", "1").strip().lower() not in ("0", "false", "no", "")
+        compress_min_size = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+        compress_level = int(os.getenv("COMPRESS_LEVEL", "6"))
+        template_cache_dir = var_dir / "jinja"
+        fragment_cache_size = int(os.getenv("FRAGMENT_CACHE_SIZE", "512"))
+        fragment_cache_ttl = float(os.getenv("FRAGMENT_CACHE_TTL", "300"))
 
         return AppConfig(
             secret_key=secret_key,
@@ -42,16 +164,74 @@ class AppConfig:
             db_path=db_path,
             upload_dir=upload_dir,
             watermarked_dir=watermarked_dir,
+            thumb_dir=thumb_dir,
             cert_dir=cert_dir,
             cert_crt_path=cert_crt_path,
             cert_key_path=cert_key_path,
             session_minutes=session_minutes,
+            watermark_workers=watermark_workers,
+            watermark_queue_depth=watermark_queue_depth,
+            upload_max_bytes=upload_max_bytes,
+            upload_max_pixels=upload_max_pixels,
+            file_offload=file_offload,
+            file_offload_prefix=file_offload_prefix,
+            db_pool_size=db_pool_size,
+            db_busy_timeout_ms=db_busy_timeout_ms,
+            db_cache_kb=db_cache_kb,
+            db_mmap_mb=db_mmap_mb,
+            audit_async=audit_async,
+            audit_batch_size=audit_batch_size,
+            audit_flush_ms=audit_flush_ms,
+            audit_queue_size=audit_queue_size,
+            audit_overflow=audit_overflow,
+            audit_hot_days=audit_hot_days,
+            audit_keep_months=audit_keep_months,
+            user_cache_size=user_cache_size,
+            user_cache_ttl=user_cache_ttl,
+            password_hash_method=password_hash_method,
+            password_salt_length=password_salt_length,
+            password_hash_workers=password_hash_workers,
+            password_hash_queue_depth=password_hash_queue_depth,
+            login_throttle=login_throttle,
+            login_ip_burst=login_ip_burst,
+            login_ip_per_minute=login_ip_per_minute,
+            login_user_burst=login_user_burst,
+            login_user_per_minute=login_user_per_minute,
+            login_throttle_persist=login_throttle_persist,
+            session_backend=session_backend,
+            session_max_entries=session_max_entries,
+            metrics_token=metrics_token,
+            profile_dir=profile_dir,
+            profile_sample_ms=profile_sample_ms,
+            profile_keep=profile_keep,
+            profile_max_active=profile_max_active,
+            probe_max_concurrent=probe_max_concurrent,
+            probe_queue_depth=probe_queue_depth,
+            probe_per_user=probe_per_user,
+            probe_timeout=probe_timeout,
+            probe_max_output=probe_max_output,
+            probe_cache_seconds=probe_cache_seconds,
+            probe_max_streams=probe_max_streams,
+            lab_sql_max_steps=lab_sql_max_steps,
+            lab_sql_timeout_ms=lab_sql_timeout_ms,
+            lab_sql_max_rows=lab_sql_max_rows,
+            lab_sql_recycle=lab_sql_recycle,
+            lab_sql_snapshot_seconds=lab_sql_snapshot_seconds,
+            static_build_dir=static_build_dir,
+            static_hashed=static_hashed,
+            compress=compress,
+            compress_min_size=compress_min_size,
+            compress_level=compress_level,
+            template_cache_dir=template_cache_dir,
+            fragment_cache_size=fragment_cache_size,
+            fragment_cache_ttl=fragment_cache_ttl,
         )
 
     def ensure_dirs(self) -> None:
         self.var_dir.mkdir(parents=True, exist_ok=True)
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.watermarked_dir.mkdir(parents=True, exist_ok=True)
+        self.thumb_dir.mkdir(parents=True, exist_ok=True)
         self.cert_dir.mkdir(parents=True, exist_ok=True)
 
     def as_flask_config(self) -> dict:
@@ -60,7 +240,67 @@ class AppConfig:
             "DB_PATH": str(self.db_path),
             "UPLOAD_DIR": str(self.upload_dir),
             "WATERMARKED_DIR": str(self.watermarked_dir),
+            "THUMB_DIR": str(self.thumb_dir),
             "SESSION_MINUTES": self.session_minutes,
+            "WATERMARK_WORKERS": self.watermark_workers,
+            "WATERMARK_QUEUE_DEPTH": self.watermark_queue_depth,
+            "UPLOAD_MAX_BYTES": self.upload_max_bytes,
+            "UPLOAD_MAX_PIXELS": self.upload_max_pixels,
+            # 整个请求体的上限（文件 + 少量表单字段），超出时在读取请求体之前直接 413
+            "MAX_CONTENT_LENGTH": self.upload_max_bytes + 64 * 1024,
+            "FILE_OFFLOAD": self.file_offload,
+            "FILE_OFFLOAD_PREFIX": self.file_offload_prefix,
+            "USE_X_SENDFILE": self.file_offload == "x-sendfile",
+            "DB_POOL_SIZE": self.db_pool_size,
+            "DB_BUSY_TIMEOUT_MS": self.db_busy_timeout_ms,
+            "DB_CACHE_KB": self.db_cache_kb,
+            "DB_MMAP_MB": self.db_mmap_mb,
+            "AUDIT_ASYNC": self.audit_async,
+            "AUDIT_BATCH_SIZE": self.audit_batch_size,
+            "AUDIT_FLUSH_MS": self.audit_flush_ms,
+            "AUDIT_QUEUE_SIZE": self.audit_queue_size,
+            "AUDIT_OVERFLOW": self.audit_overflow,
+            "AUDIT_HOT_DAYS": self.audit_hot_days,
+            "AUDIT_KEEP_MONTHS": self.audit_keep_months,
+            "USER_CACHE_SIZE": self.user_cache_size,
+            "USER_CACHE_TTL": self.user_cache_ttl,
+            "PASSWORD_HASH_METHOD": self.password_hash_method,
+            "PASSWORD_SALT_LENGTH": self.password_salt_length,
+            "PASSWORD_HASH_WORKERS": self.password_hash_workers,
+            "PASSWORD_HASH_QUEUE_DEPTH": self.password_hash_queue_depth,
+            "LOGIN_THROTTLE": self.login_throttle,
+            "LOGIN_IP_BURST": self.login_ip_burst,
+            "LOGIN_IP_PER_MINUTE": self.login_ip_per_minute,
+            "LOGIN_USER_BURST": self.login_user_burst,
+            "LOGIN_USER_PER_MINUTE": self.login_user_per_minute,
+            "LOGIN_THROTTLE_PERSIST": self.login_throttle_persist,
+            "SESSION_BACKEND": self.session_backend,
+            "SESSION_MAX_ENTRIES": self.session_max_entries,
+            "METRICS_TOKEN": self.metrics_token,
+            "PROFILE_DIR": str(self.profile_dir),
+            "PROFILE_SAMPLE_MS": self.profile_sample_ms,
+            "PROFILE_KEEP": self.profile_keep,
+            "PROFILE_MAX_ACTIVE": self.profile_max_active,
+            "PROBE_MAX_CONCURRENT": self.probe_max_concurrent,
+            "PROBE_QUEUE_DEPTH": self.probe_queue_depth,
+            "PROBE_PER_USER": self.probe_per_user,
+            "PROBE_TIMEOUT": self.probe_timeout,
+            "PROBE_MAX_OUTPUT": self.probe_max_output,
+            "PROBE_CACHE_SECONDS": self.probe_cache_seconds,
+            "PROBE_MAX_STREAMS": self.probe_max_streams,
+            "LAB_SQL_MAX_STEPS": self.lab_sql_max_steps,
+            "LAB_SQL_TIMEOUT_MS": self.lab_sql_timeout_ms,
+            "LAB_SQL_MAX_ROWS": self.lab_sql_max_rows,
+            "LAB_SQL_RECYCLE": self.lab_sql_recycle,
+            "LAB_SQL_SNAPSHOT_SECONDS": self.lab_sql_snapshot_seconds,
+            "STATIC_BUILD_DIR": str(self.static_build_dir),
+            "STATIC_HASHED": self.static_hashed,
+            "COMPRESS": self.compress,
+            "COMPRESS_MIN_SIZE": self.compress_min_size,
+            "COMPRESS_LEVEL": self.compress_level,
+            "TEMPLATE_CACHE_DIR": str(self.template_cache_dir),
+            "FRAGMENT_CACHE_SIZE": self.fragment_cache_size,
+            "FRAGMENT_CACHE_TTL": self.fragment_cache_ttl,
         }
 
     @staticmethod
@@ -1,29 +1,157 @@
 from __future__ import annotations
 
 import sqlite3
+import threading
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 
 from flask import current_app, g, request
 
+from .metrics import record_db
+from .templating import bump_fragments
 
-def _connect(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+# 结构版本：修改 init_db 中的表结构/迁移时 +1；与库文件中的 PRAGMA user_version 一致时跳过建表与迁移
+SCHEMA_VERSION = 4
+
+
+class _Connection(sqlite3.Connection):
+    # 统计每个请求的 SQL 次数与耗时（见 metrics.py）
+    def execute(self, sql, parameters=(), /):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_db(time.perf_counter() - start)
+
+    def executemany(self, sql, parameters, /):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record_db(time.perf_counter() - start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_db(time.perf_counter() - start)
+
+
+def _connect(
+    db_path: str,
+    *,
+    busy_timeout_ms: int = 5000,
+    cache_kb: int = 8192,
+    mmap_mb: int = 64,
+) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=busy_timeout_ms / 1000, factory=_Connection)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
+    # journal_mode=WAL 写在库文件里（init_db 设置一次）；以下为连接级设置
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)};")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_kb)};")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_mb) * 1024 * 1024};")
     return conn
 
 
+# 请求结束后连接归还到池中复用（LIFO，最近用过的连接缓存最热），超出 size 的连接直接关闭。
+# 取出时做一次健康检查：回滚残留事务并执行 SELECT 1，失败则丢弃重建。
+class ConnectionPool:
+    def __init__(self, db_path: str, *, size: int = 8, **pragmas: int) -> None:
+        self.db_path = db_path
+        self.size = max(0, int(size))
+        self.pragmas = pragmas
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _new(self) -> sqlite3.Connection:
+        conn = _connect(self.db_path, **self.pragmas)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    @staticmethod
+    def _healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._new()
+            if self._healthy(conn):
+                with self._lock:
+                    self.reused += 1
+                return conn
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+def init_db_pool(app) -> ConnectionPool:
+    pool = ConnectionPool(
+        app.config["DB_PATH"],
+        size=app.config["DB_POOL_SIZE"],
+        busy_timeout_ms=app.config["DB_BUSY_TIMEOUT_MS"],
+        cache_kb=app.config["DB_CACHE_KB"],
+        mmap_mb=app.config["DB_MMAP_MB"],
+    )
+    app.extensions["db_pool"] = pool
+    return pool
+
+
+def _pool() -> ConnectionPool:
+    pool = current_app.extensions.get("db_pool")
+    if pool is None:
+        pool = init_db_pool(current_app)
+    return pool
+
+
 def get_db() -> sqlite3.Connection:
     if "db" not in g:
-        g.db = _connect(current_app.config["DB_PATH"])
+        g.db = _pool().acquire()
     return g.db
 
 
 def close_db(_exc: BaseException | None = None) -> None:
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        _pool().release(db)
 
 
 def _now_iso() -> str:
@@ -34,70 +162,266 @@ def init_db(db_path: Path) -> None:
     db_path.parent.mkdir(parents=True, exist_ok=True)
     conn = _connect(str(db_path))
     try:
-        conn.executescript(
+        # WAL：读写互不阻塞，多个请求线程可同时读；该设置持久保存在库文件中
+        conn.execute("PRAGMA journal_mode = WAL;")
+        if int(conn.execute("PRAGMA user_version").fetchone()[0]) == SCHEMA_VERSION:
+            return
+        _create_schema(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          username TEXT NOT NULL UNIQUE,
+          password_hash TEXT NOT NULL,
+          is_admin INTEGER NOT NULL DEFAULT 0,
+          display_name TEXT NOT NULL DEFAULT '',
+          description TEXT NOT NULL DEFAULT '',
+          created_at TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS audit_logs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          user_id INTEGER,
+          action TEXT NOT NULL,
+          detail TEXT NOT NULL DEFAULT '',
+          ip TEXT NOT NULL DEFAULT '',
+          ua TEXT NOT NULL DEFAULT '',
+          created_at TEXT NOT NULL,
+          FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS images (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          user_id INTEGER NOT NULL,
+          original_name TEXT NOT NULL,
+          stored_name TEXT NOT NULL,
+          watermarked_name TEXT NOT NULL,
+          watermark_text TEXT NOT NULL DEFAULT '',
+          status TEXT NOT NULL DEFAULT 'ready',
+          error TEXT NOT NULL DEFAULT '',
+          created_at TEXT NOT NULL,
+          FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        );
+
+        -- 后台批量任务（批量重新生成水印等）
+        CREATE TABLE IF NOT EXISTS jobs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          user_id INTEGER NOT NULL,
+          kind TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'running',
+          total INTEGER NOT NULL DEFAULT 0,
+          ok INTEGER NOT NULL DEFAULT 0,
+          failed INTEGER NOT NULL DEFAULT 0,
+          created_at TEXT NOT NULL,
+          finished_at TEXT,
+          FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        );
+
+        -- 仅用于 SQL 注入实验（作业二-攻防实验）
+        CREATE TABLE IF NOT EXISTS notes (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          title TEXT NOT NULL,
+          content TEXT NOT NULL
+        );
+        """
+    )
+    conn.commit()
+
+    # lightweight migration for old DB files
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(users)").fetchall()}
+    if "is_admin" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0;")
+        conn.commit()
+
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(images)").fetchall()}
+    if "status" not in cols:
+        # pending / ready / failed（后台水印任务状态）
+        conn.execute("ALTER TABLE images ADD COLUMN status TEXT NOT NULL DEFAULT 'ready';")
+        conn.commit()
+    if "error" not in cols:
+        conn.execute("ALTER TABLE images ADD COLUMN error TEXT NOT NULL DEFAULT '';")
+        conn.commit()
+
+    # 内容寻址存储的引用计数（见 storage.py），由触发器随 images 增删改自动维护
+    has_refs = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blob_refs'"
+    ).fetchone()
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS blob_refs (
+          name TEXT PRIMARY KEY,
+          refs INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TRIGGER IF NOT EXISTS images_blob_refs_insert AFTER INSERT ON images BEGIN
+          INSERT INTO blob_refs (name, refs) VALUES (NEW.stored_name, 1)
+            ON CONFLICT(name) DO UPDATE SET refs = refs + 1;
+          INSERT INTO blob_refs (name, refs) VALUES (NEW.watermarked_name, 1)
+            ON CONFLICT(name) DO UPDATE SET refs = refs + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS images_blob_refs_delete AFTER DELETE ON images BEGIN
+          UPDATE blob_refs SET refs = refs - 1 WHERE name = OLD.stored_name;
+          UPDATE blob_refs SET refs = refs - 1 WHERE name = OLD.watermarked_name;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS images_blob_refs_update
+        AFTER UPDATE OF stored_name, watermarked_name ON images BEGIN
+          UPDATE blob_refs SET refs = refs - 1 WHERE name = OLD.stored_name;
+          UPDATE blob_refs SET refs = refs - 1 WHERE name = OLD.watermarked_name;
+          INSERT INTO blob_refs (name, refs) VALUES (NEW.stored_name, 1)
+            ON CONFLICT(name) DO UPDATE SET refs = refs + 1;
+          INSERT INTO blob_refs (name, refs) VALUES (NEW.watermarked_name, 1)
+            ON CONFLICT(name) DO UPDATE SET refs = refs + 1;
+        END;
+        """
+    )
+    if not has_refs:
+        conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS users (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              username TEXT NOT NULL UNIQUE,
-              password_hash TEXT NOT NULL,
-              is_admin INTEGER NOT NULL DEFAULT 0,
-              display_name TEXT NOT NULL DEFAULT '',
-              description TEXT NOT NULL DEFAULT '',
-              created_at TEXT NOT NULL,
-              updated_at TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS audit_logs (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_id INTEGER,
-              action TEXT NOT NULL,
-              detail TEXT NOT NULL DEFAULT '',
-              ip TEXT NOT NULL DEFAULT '',
-              ua TEXT NOT NULL DEFAULT '',
-              created_at TEXT NOT NULL,
-              FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS images (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_id INTEGER NOT NULL,
-              original_name TEXT NOT NULL,
-              stored_name TEXT NOT NULL,
-              watermarked_name TEXT NOT NULL,
-              watermark_text TEXT NOT NULL DEFAULT '',
-              created_at TEXT NOT NULL,
-              FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-            );
-
-            -- 仅用于 SQL 注入实验（作业二-攻防实验）
-            CREATE TABLE IF NOT EXISTS notes (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              title TEXT NOT NULL,
-              content TEXT NOT NULL
-            );
+            INSERT INTO blob_refs (name, refs)
+            SELECT name, COUNT(1) FROM (
+              SELECT stored_name AS name FROM images
+              UNION ALL
+              SELECT watermarked_name AS name FROM images
+            ) GROUP BY name
             """
         )
-        conn.commit()
+    conn.commit()
 
-        # lightweight migration for old DB files
-        cols = {r["name"] for r in conn.execute("PRAGMA table_info(users)").fetchall()}
-        if "is_admin" not in cols:
-            conn.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0;")
-            conn.commit()
+    # 列表分页：(user_id, id) 索引支持按用户的游标分页；每用户计数由触发器增量维护
+    has_counts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_image_counts'"
+    ).fetchone()
+    conn.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_images_user_id ON images(user_id, id);
+
+        CREATE TABLE IF NOT EXISTS user_image_counts (
+          user_id INTEGER PRIMARY KEY,
+          n INTEGER NOT NULL DEFAULT 0,
+          FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        );
+
+        CREATE TRIGGER IF NOT EXISTS images_count_insert AFTER INSERT ON images BEGIN
+          INSERT INTO user_image_counts (user_id, n) VALUES (NEW.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET n = n + 1;
+        END;
 
-        cur = conn.execute("SELECT COUNT(1) AS c FROM notes")
-        if int(cur.fetchone()["c"]) == 0:
-            conn.executemany(
-                "INSERT INTO notes (title, content) VALUES (?, ?)",
-                [
-                    ("Welcome", "This table is used for SQL injection lab."),
-                    ("Todo", "Try: %' OR 1=1 --  (in the insecure search)"),
-                    ("Defense", "Use parameterized queries to prevent injection."),
-                ],
+        CREATE TRIGGER IF NOT EXISTS images_count_delete AFTER DELETE ON images BEGIN
+          UPDATE user_image_counts SET n = n - 1 WHERE user_id = OLD.user_id;
+        END;
+        """
+    )
+    if not has_counts:
+        conn.execute(
+            "INSERT INTO user_image_counts (user_id, n) SELECT user_id, COUNT(1) FROM images GROUP BY user_id"
+        )
+    conn.commit()
+
+    # 全文检索：外部内容表（content=images），由触发器同步；旧库首次创建时回填
+    has_fts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'"
+    ).fetchone()
+    if not has_fts:
+        try:
+            conn.executescript(
+                """
+                CREATE VIRTUAL TABLE images_fts USING fts5(
+                  original_name, watermark_text,
+                  content='images', content_rowid='id', tokenize='trigram'
+                );
+
+                CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+                  INSERT INTO images_fts (rowid, original_name, watermark_text)
+                  VALUES (NEW.id, NEW.original_name, NEW.watermark_text);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+                  INSERT INTO images_fts (images_fts, rowid, original_name, watermark_text)
+                  VALUES ('delete', OLD.id, OLD.original_name, OLD.watermark_text);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS images_fts_update
+                AFTER UPDATE OF original_name, watermark_text ON images BEGIN
+                  INSERT INTO images_fts (images_fts, rowid, original_name, watermark_text)
+                  VALUES ('delete', OLD.id, OLD.original_name, OLD.watermark_text);
+                  INSERT INTO images_fts (rowid, original_name, watermark_text)
+                  VALUES (NEW.id, NEW.original_name, NEW.watermark_text);
+                END;
+
+                INSERT INTO images_fts (images_fts) VALUES ('rebuild');
+                """
             )
             conn.commit()
-    finally:
-        conn.close()
+        except sqlite3.OperationalError:
+            # SQLite 未编译 FTS5 或不支持 trigram 分词（< 3.34）：搜索退回 LIKE
+            conn.rollback()
+
+    # 审计日志：按用户倒序查询与按时间清理的索引；超出保留期的明细按天汇总到 audit_daily（见 audit.py）
+    conn.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_audit_logs_user_id ON audit_logs(user_id, id);
+        CREATE INDEX IF NOT EXISTS idx_audit_logs_created_at ON audit_logs(created_at);
+
+        CREATE TABLE IF NOT EXISTS audit_daily (
+          day TEXT NOT NULL,
+          user_id INTEGER NOT NULL DEFAULT 0,
+          action TEXT NOT NULL,
+          n INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY (user_id, day, action)
+        );
+        """
+    )
+    conn.commit()
+
+    # 登录限流状态（LOGIN_THROTTLE_PERSIST=1 时在退出前保存，见 throttle.py）
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS login_throttle (
+          key TEXT PRIMARY KEY,
+          tokens REAL NOT NULL,
+          updated REAL NOT NULL
+        );
+        """
+    )
+    conn.commit()
+
+    # 服务端会话（SESSION_BACKEND=sqlite，见 sessions.py）；data 为紧凑 JSON，cookie 中只保存 sid
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+          sid TEXT PRIMARY KEY,
+          user_id INTEGER,
+          data TEXT NOT NULL,
+          expires REAL NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires);
+        """
+    )
+    conn.commit()
+
+    cur = conn.execute("SELECT COUNT(1) AS c FROM notes")
+    if int(cur.fetchone()["c"]) == 0:
+        conn.executemany(
+            "INSERT INTO notes (title, content) VALUES (?, ?)",
+            [
+                ("Welcome", "This table is used for SQL injection lab."),
+                ("Todo", "Try: %' OR 1=1 --  (in the insecure search)"),
+                ("Defense", "Use parameterized queries to prevent injection."),
+            ],
+        )
+        conn.commit()
 
 
 def init_db_if_missing(db_path: Path) -> None:
@@ -108,19 +432,29 @@ def init_db_if_missing(db_path: Path) -> None:
 def log_action(user_id: int | None, action: str, detail: str = "") -> None:
     ip = request.remote_addr or ""
     ua = request.headers.get("User-Agent", "")
+    event = (user_id, action, detail, ip, ua, _now_iso())
+    bump_fragments("audit", user_id)
+    # 启用 AUDIT_ASYNC 时交给后台线程批量写入（见 audit.py）
+    writer = current_app.extensions.get("audit_writer")
+    if writer is not None:
+        writer.submit(event)
+        return
     get_db().execute(
         """
         INSERT INTO audit_logs (user_id, action, detail, ip, ua, created_at)
         VALUES (?, ?, ?, ?, ?, ?)
         """,
-        (user_id, action, detail, ip, ua, _now_iso()),
+        event,
     )
     get_db().commit()
 
 
 def fetch_many(sql: str, params: tuple = ()) -> list[dict]:
     cur = get_db().execute(sql, params)
+    start = time.perf_counter()
     rows = cur.fetchall()
+    # 余下的行在 fetchall 时才逐步执行，计入同一条语句的耗时
+    record_db(time.perf_counter() - start, count=False)
     return [dict(r) for r in rows]
 
 
@@ -1,13 +1,24 @@
 from __future__ import annotations
 
+import mimetypes
 from pathlib import Path
-from uuid import uuid4
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-from flask import Blueprint, flash, g, redirect, render_template, request, send_file, url_for, current_app
+from flask import Blueprint, Response, flash, g, redirect, render_template, request, send_file, url_for, current_app
+from markupsafe import Markup
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
 from .auth import login_required
 from .db import fetch_many, fetch_one, get_db, log_action
+from .ingest import ingest_file_storage
+from .jobs import BatchItem, QueueBusy, get_watermark_queue
+from .metrics import add_bytes_served, observe_render
+from .search import HL_END, HL_START, build_match_query, highlight_html
+from .security import csrf_token
+from .storage import collect_garbage, original_name_for, storage_lock, watermarked_name_for
+from .templating import bump_fragments, cached_fragment, fragment_key
+from .thumbs import THUMB_WIDTHS, ensure_thumbnail, pick_format, snap_width
 from .watermark import add_text_watermark
 
 bp = Blueprint("images", __name__)
@@ -51,59 +62,249 @@ def _page_items(page: int, pages: int, *, window: int = 2) -> list[int | None]:
     return items
 
 
-def _delete_files(stored_name: str, watermarked_name: str) -> None:
-    src_path, dst_path = _paths_for(stored_name, watermarked_name)
-    try:
-        src_path.unlink(missing_ok=True)
-    except Exception:
-        pass
-    try:
-        dst_path.unlink(missing_ok=True)
-    except Exception:
-        pass
+_STATUS_LABELS = {"pending": "水印生成中…", "failed": "水印生成失败"}
 
 
-@bp.get("/images")
-@login_required
-def index():
-    q = (request.args.get("q") or "").strip()
-    per_page = _get_int_arg("per_page", 12, min_value=6, max_value=60)
-    page = _get_int_arg("page", 1, min_value=1, max_value=10_000)
+def _status_placeholder(status: str) -> Response:
+    label = _STATUS_LABELS.get(status, status)
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="240" height="160" viewBox="0 0 240 160">'
+        '<rect width="240" height="160" fill="#e2e8f0"/>'
+        f'<text x="120" y="86" font-size="16" text-anchor="middle" fill="#475569">{label}</text>'
+        "</svg>"
+    )
+    resp = Response(svg, mimetype="image/svg+xml")
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+# 存储文件名不可变（内容寻址），可直接作为强 ETag；URL 中带有匹配的 v 参数时允许浏览器长期缓存
+_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _version(name: str) -> str:
+    return Path(name).stem[:16]
+
+
+def _send_stored(path: Path, name: str, *, as_attachment: bool = False, download_name: str | None = None) -> Response:
+    etag = name
+    immutable = request.args.get("v") == _version(name)
+
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+        resp.set_etag(etag)
+    elif current_app.config.get("FILE_OFFLOAD") == "x-accel-redirect":
+        # 只做权限校验，文件由 nginx 的 internal location 发送（Range / 304 也由 nginx 处理）
+        prefix = current_app.config["FILE_OFFLOAD_PREFIX"]
+        resp = Response(mimetype=mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+        resp.headers["X-Accel-Redirect"] = f"{prefix}/{path.parent.name}/{path.name}"
+        if as_attachment:
+            resp.headers.set("Content-Disposition", "attachment", filename=download_name or path.name)
+        resp.set_etag(etag)
+    else:
+        # USE_X_SENDFILE（FILE_OFFLOAD=x-sendfile）时 send_file 只返回 X-Sendfile 头；
+        # 否则文件对象经 wsgi.file_wrapper 交给服务器（waitress 在 I/O 线程发送，不占用工作线程）
+        # conditional=True：If-None-Match / If-Modified-Since -> 304，Range / If-Range -> 206
+        resp = send_file(path, as_attachment=as_attachment, download_name=download_name, etag=etag, conditional=True)
+
+    if resp.status_code in (200, 206):
+        if "X-Accel-Redirect" in resp.headers or "X-Sendfile" in resp.headers:
+            add_bytes_served("offload", path.stat().st_size if resp.status_code == 200 else 0)
+        else:
+            add_bytes_served("wsgi", resp.content_length)
+
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    if immutable:
+        resp.cache_control.no_cache = None
+        resp.cache_control.max_age = _IMMUTABLE_MAX_AGE
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.max_age = None
+        resp.cache_control.no_cache = True
+    return resp
+
+
+def _release_files(rows: list[dict]) -> None:
+    # 记录删除后调用：只删除引用计数已归零的文件
+    collect_garbage(
+        get_db(),
+        Path(current_app.config["UPLOAD_DIR"]),
+        Path(current_app.config["WATERMARKED_DIR"]),
+        thumb_dir=Path(current_app.config["THUMB_DIR"]),
+        stored_names=[r["stored_name"] for r in rows],
+        watermarked_names=[r["watermarked_name"] for r in rows],
+    )
+
+
+def _job_status(job_id: int) -> dict | None:
+    row = fetch_one(
+        "SELECT id, kind, status, total, ok, failed, created_at, finished_at FROM jobs WHERE id = ? AND user_id = ?",
+        (job_id, g.user["id"]),
+    )
+    if row and row["status"] == "running":
+        progress = get_watermark_queue().progress(job_id)
+        if progress:
+            row.update(progress)
+    return row
+
 
+def _search_where(q: str) -> tuple[str, list[object], str | None]:
     where = "user_id = ?"
     params: list[object] = [g.user["id"]]
-    if q:
+    match = build_match_query(q) if q else None
+    if match:
+        where += " AND id IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)"
+        params.append(match)
+    elif q:
         where += " AND (original_name LIKE ? OR watermark_text LIKE ?)"
         like = f"%{q}%"
         params.extend([like, like])
+    return where, params, match
 
-    total_row = fetch_one(f"SELECT COUNT(1) AS c FROM images WHERE {where}", tuple(params))
-    total = int((total_row or {}).get("c", 0))
-    pages = max(1, (total + per_page - 1) // per_page)
-    page = min(page, pages)
-    offset = (page - 1) * per_page
 
-    images = fetch_many(
+def _attach_highlights(rows: list[dict], match: str | None, *, as_text: bool = False) -> None:
+    if not match or not rows:
+        return
+    placeholders = ",".join("?" for _ in rows)
+    hits = fetch_many(
         f"""
-        SELECT id, original_name, watermark_text, created_at
-        FROM images
-        WHERE {where}
-        ORDER BY id DESC
-        LIMIT ? OFFSET ?
+        SELECT rowid AS id,
+               highlight(images_fts, 0, ?, ?) AS name_hl,
+               snippet(images_fts, 1, ?, ?, '…', 16) AS text_hl,
+               bm25(images_fts) AS rank
+        FROM images_fts
+        WHERE images_fts MATCH ? AND rowid IN ({placeholders})
         """,
-        tuple(params + [per_page, offset]),
+        tuple([HL_START, HL_END, HL_START, HL_END, match] + [r["id"] for r in rows]),
     )
+    by_id = {int(h["id"]): h for h in hits}
+    for r in rows:
+        hit = by_id.get(int(r["id"]))
+        if hit:
+            name_hl, text_hl = highlight_html(hit["name_hl"]), highlight_html(hit["text_hl"])
+            # JSON 接口返回已转义的 HTML 片段字符串
+            r["name_hl"] = str(name_hl) if as_text else name_hl
+            r["text_hl"] = str(text_hl) if as_text else text_hl
+            r["rank"] = hit["rank"]
+
+
+def _count_images(q: str, where: str, params: list[object]) -> int:
+    if not q:
+        # 每个用户的图片数由触发器增量维护，无需每次 COUNT
+        row = fetch_one("SELECT n FROM user_image_counts WHERE user_id = ?", (g.user["id"],))
+        return int((row or {}).get("n", 0))
+    row = fetch_one(f"SELECT COUNT(1) AS c FROM images WHERE {where}", tuple(params))
+    return int((row or {}).get("c", 0))
+
+
+def _fetch_page(
+    columns: str,
+    where: str,
+    params: list[object],
+    per_page: int,
+    *,
+    before_id: int = 0,
+    after_id: int = 0,
+    offset: int = 0,
+) -> tuple[list[dict], bool, bool]:
+    # 返回 (按 id 倒序的记录, 是否还有更早的记录, 是否还有更新的记录)
+    # 游标（before_id / after_id）走 (user_id, id) 索引范围扫描，不受页码深度影响
+    if after_id:
+        rows = fetch_many(
+            f"SELECT {columns} FROM images WHERE {where} AND id > ? ORDER BY id ASC LIMIT ?",
+            tuple(params + [after_id, per_page + 1]),
+        )
+        has_newer = len(rows) > per_page
+        return rows[:per_page][::-1], True, has_newer
+
+    if before_id:
+        rows = fetch_many(
+            f"SELECT {columns} FROM images WHERE {where} AND id < ? ORDER BY id DESC LIMIT ?",
+            tuple(params + [before_id, per_page + 1]),
+        )
+        has_newer = True
+    else:
+        rows = fetch_many(
+            f"SELECT {columns} FROM images WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            tuple(params + [per_page + 1, offset]),
+        )
+        has_newer = offset > 0
+    has_older = len(rows) > per_page
+    return rows[:per_page], has_older, has_newer
 
-    return render_template(
-        "images.html",
-        images=images,
-        q=q,
-        total=total,
-        page=page,
-        per_page=per_page,
-        pages=pages,
-        page_items=_page_items(page, pages),
-    )
+
+@bp.get("/images")
+@login_required
+def index():
+    q = (request.args.get("q") or "").strip()
+    per_page = _get_int_arg("per_page", 12, min_value=6, max_value=60)
+    page = _get_int_arg("page", 1, min_value=1, max_value=10_000)
+    before_id = _get_int_arg("before_id", 0, min_value=0, max_value=2**62)
+    after_id = _get_int_arg("after_id", 0, min_value=0, max_value=2**62)
+
+    def render():
+        where, params, match = _search_where(q)
+        total = _count_images(q, where, params)
+        pages = max(1, (total + per_page - 1) // per_page)
+        page_ = min(page, pages)
+        # 页码跳转仍用 OFFSET；上一页/下一页用游标，page 仅用于展示
+        offset = 0 if (before_id or after_id) else (page_ - 1) * per_page
+
+        images, has_older, has_newer = _fetch_page(
+            "id, original_name, watermarked_name, watermark_text, status, created_at",
+            where,
+            params,
+            per_page,
+            before_id=before_id,
+            after_id=after_id,
+            offset=offset,
+        )
+        prev_url = next_url = None
+        if images and has_newer:
+            prev_url = url_for("images.index", q=q, per_page=per_page, page=max(1, page_ - 1), after_id=images[0]["id"])
+        if images and has_older:
+            next_url = url_for("images.index", q=q, per_page=per_page, page=min(pages, page_ + 1), before_id=images[-1]["id"])
+        for img in images:
+            img["v"] = _version(img.pop("watermarked_name"))
+        _attach_highlights(images, match)
+
+        html = Markup(
+            render_template(
+                "_image_list.html",
+                images=images,
+                q=q,
+                total=total,
+                page=page_,
+                per_page=per_page,
+                pages=pages,
+                page_items=_page_items(page_, pages),
+                prev_url=prev_url,
+                next_url=next_url,
+            )
+        )
+        # 含“生成中”记录的页面由后台任务改写状态，不缓存
+        return {"html": html, "total": total}, all(img["status"] != "pending" for img in images)
+
+    # 片段中含删除表单的 CSRF token，键中一并包含
+    key = fragment_key("images", g.user["id"], q, per_page, page, before_id, after_id, csrf_token())
+    image_list = cached_fragment(key, render)
+
+    job = None
+    job_id = _get_int_arg("job", 0, min_value=0, max_value=2**62)
+    if job_id:
+        job = _job_status(job_id)
+
+    return render_template("images.html", image_list=image_list, job=job, q=q, per_page=per_page)
+
+
+@bp.app_errorhandler(RequestEntityTooLarge)
+def upload_too_large(e: RequestEntityTooLarge):
+    if request.endpoint != "images.upload":
+        return e
+    limit_mb = int(current_app.config["UPLOAD_MAX_BYTES"]) // (1024 * 1024)
+    flash(f"文件过大（上限 {limit_mb} MB）", "danger")
+    return redirect(url_for("images.index"))
 
 
 @bp.post("/images/upload")
@@ -116,37 +317,57 @@ def upload():
         flash("请选择图片文件", "warning")
         return redirect(url_for("images.index"))
 
-    original_name = secure_filename(file.filename)
-    suffix = Path(original_name).suffix.lower()
-    if suffix not in {".png", ".jpg", ".jpeg", ".bmp", ".webp"}:
-        flash("仅支持 png/jpg/jpeg/bmp/webp", "danger")
+    original_name = secure_filename(file.filename) or "image"
+    ingest = ingest_file_storage(file)
+    info = ingest.finish()
+    if info is None:
+        ingest.close()
+        flash(ingest.error or "上传失败", "danger")
         return redirect(url_for("images.index"))
 
-    stored_name = f"{uuid4().hex}{suffix}"
-    watermarked_name = f"{uuid4().hex}.jpg"
+    stored_name = original_name_for(info.sha256, info.suffix)
+    watermarked_name = watermarked_name_for(stored_name, watermark_text)
     src_path, dst_path = _paths_for(stored_name, watermarked_name)
 
-    src_path.parent.mkdir(parents=True, exist_ok=True)
-    file.save(str(src_path))
+    with storage_lock():
+        if src_path.exists():
+            ingest.close()
+        else:
+            ingest.commit(src_path)
+        reused = dst_path.exists()
+        cur = get_db().execute(
+            """
+            INSERT INTO images (user_id, original_name, stored_name, watermarked_name, watermark_text, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+            """,
+            (g.user["id"], original_name, stored_name, watermarked_name, watermark_text, "ready" if reused else "pending"),
+        )
+        image_id = int(cur.lastrowid)
+        get_db().commit()
+    bump_fragments("images", g.user["id"])
+
+    if reused:
+        log_action(g.user["id"], "image_upload", original_name)
+        flash("上传成功，已生成水印图", "success")
+        return redirect(url_for("images.index"))
+
+    if get_watermark_queue().submit(image_id, stored_name, watermarked_name, watermark_text):
+        log_action(g.user["id"], "image_upload", original_name)
+        flash("上传成功，水印图生成中", "success")
+        return redirect(url_for("images.index"))
 
+    # 队列已满或未启用后台任务：在请求内同步生成
     try:
-        add_text_watermark(src_path, dst_path, watermark_text)
+        observe_render(add_text_watermark(src_path, dst_path, watermark_text))
     except Exception:
         # cleanup best-effort
-        try:
-            src_path.unlink(missing_ok=True)
-        except Exception:
-            pass
+        get_db().execute("DELETE FROM images WHERE id = ?", (image_id,))
+        get_db().commit()
+        _release_files([{"stored_name": stored_name, "watermarked_name": watermarked_name}])
         flash("水印处理失败（请更换图片重试）", "danger")
         return redirect(url_for("images.index"))
 
-    get_db().execute(
-        """
-        INSERT INTO images (user_id, original_name, stored_name, watermarked_name, watermark_text, created_at)
-        VALUES (?, ?, ?, ?, ?, datetime('now'))
-        """,
-        (g.user["id"], original_name, stored_name, watermarked_name, watermark_text),
-    )
+    get_db().execute("UPDATE images SET status = 'ready' WHERE id = ?", (image_id,))
     get_db().commit()
     log_action(g.user["id"], "image_upload", original_name)
     flash("上传成功，已生成水印图", "success")
@@ -157,12 +378,14 @@ def upload():
 @login_required
 def detail(image_id: int):
     row = fetch_one(
-        "SELECT id, original_name, stored_name, watermarked_name, watermark_text, created_at FROM images WHERE id = ? AND user_id = ?",
+        "SELECT id, original_name, stored_name, watermarked_name, watermark_text, status, error, created_at FROM images WHERE id = ? AND user_id = ?",
         (image_id, g.user["id"]),
     )
     if not row:
         flash("图片不存在或无权限", "warning")
         return redirect(url_for("images.index"))
+    row["v"] = _version(row["watermarked_name"])
+    row["src_v"] = _version(row["stored_name"])
     return render_template("image_detail.html", image=row)
 
 
@@ -170,12 +393,14 @@ def detail(image_id: int):
 @login_required
 def preview(image_id: int):
     row = fetch_one(
-        "SELECT watermarked_name FROM images WHERE id = ? AND user_id = ?",
+        "SELECT watermarked_name, status FROM images WHERE id = ? AND user_id = ?",
         (image_id, g.user["id"]),
     )
     if not row:
         flash("图片不存在或无权限", "warning")
         return redirect(url_for("images.index"))
+    if row["status"] != "ready":
+        return _status_placeholder(row["status"])
 
     wm_dir = Path(current_app.config["WATERMARKED_DIR"])
     path = wm_dir / row["watermarked_name"]
@@ -183,7 +408,40 @@ def preview(image_id: int):
         flash("文件缺失，请重新上传生成", "danger")
         return redirect(url_for("images.index"))
 
-    return send_file(path, as_attachment=False)
+    return _send_stored(path, row["watermarked_name"])
+
+
+@bp.get("/images/<int:image_id>/thumb")
+@login_required
+def thumb(image_id: int):
+    row = fetch_one(
+        "SELECT watermarked_name, status FROM images WHERE id = ? AND user_id = ?",
+        (image_id, g.user["id"]),
+    )
+    if not row:
+        flash("图片不存在或无权限", "warning")
+        return redirect(url_for("images.index"))
+    if row["status"] != "ready":
+        return _status_placeholder(row["status"])
+
+    wm_dir = Path(current_app.config["WATERMARKED_DIR"])
+    src = wm_dir / row["watermarked_name"]
+    if not src.exists():
+        flash("文件缺失，请重新上传生成", "danger")
+        return redirect(url_for("images.index"))
+
+    width = snap_width(_get_int_arg("w", 240, min_value=1, max_value=THUMB_WIDTHS[-1]))
+    # 只认 Accept 中显式列出的 image/webp：*/* 或 image/* 也“匹配” webp，但不代表客户端能解码
+    fmt = pick_format(any(m.lower() == "image/webp" and q > 0 for m, q in request.accept_mimetypes))
+    try:
+        path = ensure_thumbnail(src, Path(current_app.config["THUMB_DIR"]), row["watermarked_name"], width, fmt)
+    except Exception:
+        # 缩略图生成失败时退回原尺寸水印图
+        return _send_stored(src, row["watermarked_name"])
+
+    resp = _send_stored(path, path.name)
+    resp.vary.add("Accept")
+    return resp
 
 
 @bp.get("/images/<int:image_id>/original")
@@ -203,19 +461,22 @@ def original(image_id: int):
         flash("原图文件缺失", "danger")
         return redirect(url_for("images.index"))
 
-    return send_file(path, as_attachment=False)
+    return _send_stored(path, row["stored_name"])
 
 
 @bp.get("/images/<int:image_id>/download")
 @login_required
 def download(image_id: int):
     row = fetch_one(
-        "SELECT watermarked_name, original_name FROM images WHERE id = ? AND user_id = ?",
+        "SELECT watermarked_name, original_name, status FROM images WHERE id = ? AND user_id = ?",
         (image_id, g.user["id"]),
     )
     if not row:
         flash("图片不存在或无权限", "warning")
         return redirect(url_for("images.index"))
+    if row["status"] != "ready":
+        flash(_STATUS_LABELS.get(row["status"], row["status"]), "warning")
+        return redirect(url_for("images.detail", image_id=image_id))
 
     wm_dir = Path(current_app.config["WATERMARKED_DIR"])
     path = wm_dir / row["watermarked_name"]
@@ -224,7 +485,7 @@ def download(image_id: int):
         return redirect(url_for("images.index"))
 
     download_name = f"watermarked-{Path(row['original_name']).stem}.jpg"
-    return send_file(path, as_attachment=True, download_name=download_name)
+    return _send_stored(path, row["watermarked_name"], as_attachment=True, download_name=download_name)
 
 
 @bp.post("/images/bulk")
@@ -246,7 +507,7 @@ def bulk_action():
     placeholders = ",".join("?" for _ in image_ids)
     rows = fetch_many(
         f"""
-        SELECT id, stored_name, watermarked_name, original_name, watermark_text
+        SELECT id, stored_name, watermarked_name, original_name, watermark_text, status
         FROM images
         WHERE user_id = ? AND id IN ({placeholders})
         """,
@@ -260,65 +521,57 @@ def bulk_action():
         return redirect(next_url or url_for("images.index"))
 
     if action == "delete":
-        for image_id in found_ids:
-            r = by_id[image_id]
-            _delete_files(r["stored_name"], r["watermarked_name"])
-
         placeholders2 = ",".join("?" for _ in found_ids)
         get_db().execute(
             f"DELETE FROM images WHERE user_id = ? AND id IN ({placeholders2})",
             tuple([g.user["id"]] + found_ids),
         )
         get_db().commit()
+        bump_fragments("images", g.user["id"])
+        _release_files([by_id[image_id] for image_id in found_ids])
         log_action(g.user["id"], "image_bulk_delete", f"count={len(found_ids)}")
         flash(f"已删除 {len(found_ids)} 条记录", "info")
         return redirect(next_url or url_for("images.index"))
 
     if action == "regenerate":
         new_text = (request.form.get("watermark_text") or "").strip()
-        ok = 0
-        failed = 0
+        items: list[BatchItem] = []
+        skipped = 0
 
         for image_id in found_ids:
             r = by_id[image_id]
             text = new_text or (r.get("watermark_text") or "")
-            src_path, _old_dst_path = _paths_for(r["stored_name"], r["watermarked_name"])
-            if not src_path.exists():
-                failed += 1
+            src_path, _dst_path = _paths_for(r["stored_name"], r["watermarked_name"])
+            # 原图缺失或首次生成尚未完成的记录直接计为失败
+            if r["status"] == "pending" or not src_path.exists():
+                skipped += 1
                 continue
-
-            new_watermarked_name = f"{uuid4().hex}.jpg"
-            _src_path, new_dst_path = _paths_for(r["stored_name"], new_watermarked_name)
-            try:
-                add_text_watermark(src_path, new_dst_path, text)
-            except Exception:
-                try:
-                    new_dst_path.unlink(missing_ok=True)
-                except Exception:
-                    pass
-                failed += 1
-                continue
-
-            try:
-                _old_dst_path.unlink(missing_ok=True)
-            except Exception:
-                pass
-
-            get_db().execute(
-                "UPDATE images SET watermarked_name = ?, watermark_text = ? WHERE id = ? AND user_id = ?",
-                (new_watermarked_name, text, image_id, g.user["id"]),
+            items.append(
+                BatchItem(
+                    image_id=image_id,
+                    stored_name=r["stored_name"],
+                    old_watermarked_name=r["watermarked_name"],
+                    new_watermarked_name=watermarked_name_for(r["stored_name"], text),
+                    text=text,
+                )
             )
-            ok += 1
 
-        get_db().commit()
-        log_action(g.user["id"], "image_bulk_regenerate", f"ok={ok} failed={failed}")
-        if ok and failed:
-            flash(f"已重新生成 {ok} 条，失败 {failed} 条（原图文件缺失或处理失败）", "warning")
-        elif ok:
-            flash(f"已重新生成 {ok} 条水印图", "success")
+        try:
+            job_id = get_watermark_queue().submit_batch(g.user["id"], items, failed=skipped)
+        except QueueBusy:
+            flash("水印队列繁忙，请稍后再试或减少勾选数量", "warning")
+            return redirect(next_url or url_for("images.index"))
+        bump_fragments("images", g.user["id"])
+        log_action(g.user["id"], "image_bulk_regenerate", f"job={job_id} count={len(items)} skipped={skipped}")
+        if items:
+            flash(f"已提交批量重新生成任务 #{job_id}（共 {len(items)} 条）", "success")
         else:
             flash("重新生成失败（原图文件缺失或处理失败）", "danger")
-        return redirect(next_url or url_for("images.index"))
+        # next 中可能已带有上一次的 job 参数：替换而不是追加
+        parts = urlsplit(next_url or url_for("images.index"))
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != "job"]
+        query.append(("job", str(job_id)))
+        return redirect(urlunsplit(parts._replace(query=urlencode(query))))
 
     flash("不支持的操作", "danger")
     return redirect(next_url or url_for("images.index"))
@@ -335,10 +588,10 @@ def delete(image_id: int):
         flash("图片不存在或无权限", "warning")
         return redirect(url_for("images.index"))
 
-    _delete_files(row["stored_name"], row["watermarked_name"])
-
     get_db().execute("DELETE FROM images WHERE id = ? AND user_id = ?", (image_id, g.user["id"]))
     get_db().commit()
+    bump_fragments("images", g.user["id"])
+    _release_files([row])
     log_action(g.user["id"], "image_delete", row["original_name"])
     flash("已删除", "info")
     return redirect(url_for("images.index"))
@@ -350,23 +603,71 @@ def api_images():
     q = (request.args.get("q") or "").strip()
     per_page = _get_int_arg("per_page", 200, min_value=1, max_value=200)
     page = _get_int_arg("page", 1, min_value=1, max_value=10_000)
+    before_id = _get_int_arg("before_id", 0, min_value=0, max_value=2**62)
+    after_id = _get_int_arg("after_id", 0, min_value=0, max_value=2**62)
+
+    where, params, match = _search_where(q)
+    if match and request.args.get("sort") == "rank":
+        # 按相关度（bm25）排序时无法使用 id 游标，退回 OFFSET 分页
+        offset = (page - 1) * per_page
+        rows = fetch_many(
+            """
+            SELECT i.id, i.original_name, i.watermark_text, i.status, i.created_at
+            FROM images_fts JOIN images i ON i.id = images_fts.rowid
+            WHERE images_fts MATCH ? AND i.user_id = ?
+            ORDER BY bm25(images_fts)
+            LIMIT ? OFFSET ?
+            """,
+            (match, g.user["id"], per_page + 1, offset),
+        )
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        _attach_highlights(rows, match, as_text=True)
+        return {
+            "images": rows,
+            "page": page,
+            "per_page": per_page,
+            "next_page": page + 1 if has_more else None,
+            "next_cursor": None,
+            "prev_cursor": None,
+        }
+
+    rows, has_older, has_newer = _fetch_page(
+        "id, original_name, watermark_text, status, created_at",
+        where,
+        params,
+        per_page,
+        before_id=before_id,
+        after_id=after_id,
+        offset=0 if (before_id or after_id) else (page - 1) * per_page,
+    )
+    _attach_highlights(rows, match, as_text=True)
+    return {
+        "images": rows,
+        "page": page,
+        "per_page": per_page,
+        # 下一页：?before_id=next_cursor；上一页：?after_id=prev_cursor
+        "next_cursor": rows[-1]["id"] if rows and has_older else None,
+        "prev_cursor": rows[0]["id"] if rows and has_newer else None,
+    }
+
+
+@bp.get("/api/images/<int:image_id>")
+@login_required
+def api_image(image_id: int):
+    row = fetch_one(
+        "SELECT id, original_name, watermark_text, status, error, created_at FROM images WHERE id = ? AND user_id = ?",
+        (image_id, g.user["id"]),
+    )
+    if not row:
+        return {"error": "not found"}, 404
+    return row
 
-    where = "user_id = ?"
-    params: list[object] = [g.user["id"]]
-    if q:
-        where += " AND (original_name LIKE ? OR watermark_text LIKE ?)"
-        like = f"%{q}%"
-        params.extend([like, like])
 
-    offset = (page - 1) * per_page
-    rows = fetch_many(
-        f"""
-        SELECT id, original_name, watermark_text, created_at
-        FROM images
-        WHERE {where}
-        ORDER BY id DESC
-        LIMIT ? OFFSET ?
-        """,
-        tuple(params + [per_page, offset]),
-    )
-    return {"images": rows, "page": page, "per_page": per_page}
+@bp.get("/api/jobs/<int:job_id>")
+@login_required
+def api_job(job_id: int):
+    row = _job_status(job_id)
+    if not row:
+        return {"error": "not found"}, 404
+    return row
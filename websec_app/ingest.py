@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from flask import Request, current_app
+from PIL import Image
+
+# 只需要前几 KB 就能识别格式和尺寸；JPEG 的 EXIF 段最大 64KB，所以取 64KB
+SNIFF_BYTES = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_FORMAT_SUFFIX = {"png": ".png", "jpeg": ".jpg", "bmp": ".bmp", "webp": ".webp"}
+
+
+def sniff_format(head: bytes) -> str | None:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"BM"):
+        return "bmp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+@dataclass(frozen=True)
+class Ingested:
+    sha256: str
+    size: int
+    format: str
+    width: int | None
+    height: int | None
+
+    @property
+    def suffix(self) -> str:
+        return _FORMAT_SUFFIX[self.format]
+
+
+# 作为 multipart 解析器的文件容器：边接收边识别格式、计算哈希并写入上传目录下的临时文件。
+# 识别失败或超限后后续数据直接丢弃，不再落盘。
+class IngestFile:
+    def __init__(self, directory: Path, *, max_bytes: int, max_pixels: int) -> None:
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.max_pixels = int(max_pixels)
+        self.size = 0
+        self.error: str | None = None
+        self.format: str | None = None
+        self.width: int | None = None
+        self.height: int | None = None
+        self._head = bytearray()
+        self._hash = hashlib.sha256()
+        self._fh = None
+        self._tmp_path: Path | None = None
+
+    def _reject(self, message: str) -> None:
+        self.error = message
+        self._head = bytearray()
+        self._discard()
+
+    def _discard(self) -> None:
+        fh, self._fh = self._fh, None
+        if fh is not None:
+            fh.close()
+        tmp, self._tmp_path = self._tmp_path, None
+        if tmp is not None:
+            try:
+                tmp.unlink(missing_ok=True)
+            except Exception:
+                pass
+
+    def _sniff(self, *, complete: bool) -> None:
+        head = bytes(self._head)
+        fmt = sniff_format(head)
+        if fmt is None:
+            self._reject("不是支持的图片格式（仅支持 png/jpg/jpeg/bmp/webp）")
+            return
+
+        try:
+            with Image.open(io.BytesIO(head)) as im:
+                self.width, self.height = im.size
+        except Exception:
+            # 头部不完整时留给后续解码判断；完整文件仍无法识别则直接拒绝
+            if complete:
+                self._reject("图片文件已损坏或无法识别")
+                return
+
+        if self.width and self.height and self.width * self.height > self.max_pixels:
+            self._reject(f"图片尺寸过大（{self.width}x{self.height}）")
+            return
+
+        self.format = fmt
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(prefix=".ingest-", suffix=".part", dir=self.directory)
+        self._fh = os.fdopen(fd, "w+b")
+        self._tmp_path = Path(name)
+        self._fh.write(head)
+        self._head = bytearray()
+
+    def write(self, data: bytes) -> int:
+        n = len(data)
+        if self.error:
+            return n
+
+        self.size += n
+        if self.size > self.max_bytes:
+            self._reject(f"文件过大（上限 {self.max_bytes // (1024 * 1024)} MB）")
+            return n
+
+        self._hash.update(data)
+        if self._fh is not None:
+            self._fh.write(data)
+        else:
+            self._head += data
+            if len(self._head) >= SNIFF_BYTES:
+                self._sniff(complete=False)
+        return n
+
+    def finish(self) -> Ingested | None:
+        if not self.error and self._fh is None:
+            if not self._head:
+                self._reject("上传文件为空")
+            else:
+                self._sniff(complete=True)
+        if self.error or self.format is None:
+            return None
+        self._fh.flush()
+        if not (self.width and self.height):
+            # 前 64KB 不足以读出尺寸（如 SOF 之前有很大的 EXIF/ICC/XMP 段）：用完整文件补做尺寸检查，
+            # 否则像素上限会被绕过。Image.open 只解析文件头，不解码像素
+            try:
+                with Image.open(self._tmp_path) as im:
+                    self.width, self.height = im.size
+            except Exception:
+                self._reject("图片文件已损坏或无法识别")
+                return None
+            if self.width * self.height > self.max_pixels:
+                self._reject(f"图片尺寸过大（{self.width}x{self.height}）")
+                return None
+        return Ingested(
+            sha256=self._hash.hexdigest(),
+            size=self.size,
+            format=self.format,
+            width=self.width,
+            height=self.height,
+        )
+
+    def commit(self, dest: Path) -> None:
+        if self._tmp_path is None:
+            raise RuntimeError("nothing to commit")
+        fh, self._fh = self._fh, None
+        fh.close()
+        os.replace(self._tmp_path, dest)
+        self._tmp_path = None
+
+    # file-like API expected by werkzeug's FileStorage
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._fh.seek(offset, whence) if self._fh is not None else 0
+
+    def tell(self) -> int:
+        return self._fh.tell() if self._fh is not None else 0
+
+    def read(self, size: int = -1) -> bytes:
+        return self._fh.read(size) if self._fh is not None else b""
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._fh.readline(size) if self._fh is not None else b""
+
+    def flush(self) -> None:
+        if self._fh is not None:
+            self._fh.flush()
+
+    def close(self) -> None:
+        self._discard()
+
+
+def new_ingest_file() -> IngestFile:
+    return IngestFile(
+        Path(current_app.config["UPLOAD_DIR"]),
+        max_bytes=current_app.config["UPLOAD_MAX_BYTES"],
+        max_pixels=current_app.config["UPLOAD_MAX_PIXELS"],
+    )
+
+
+def ingest_file_storage(file) -> IngestFile:
+    stream = file.stream
+    if isinstance(stream, IngestFile):
+        return stream
+
+    # 非流式解析（例如测试客户端直接构造的 FileStorage）时按块复制
+    ingest = new_ingest_file()
+    while not ingest.error:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        ingest.write(chunk)
+    return ingest
+
+
+class IngestRequest(Request):
+    def _get_file_stream(
+        self,
+        total_content_length: int | None,
+        content_type: str | None,
+        filename: str | None = None,
+        content_length: int | None = None,
+    ):
+        if self.endpoint == "images.upload":
+            return new_ingest_file()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
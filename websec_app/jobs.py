@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+
+from flask import current_app
+
+from .db import _connect
+from .metrics import observe_render
+from .storage import collect_garbage, storage_lock
+from .watermark import add_text_watermark
+
+
+class QueueBusy(Exception):
+    pass
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).astimezone().isoformat(timespec="seconds")
+
+
+@dataclass
+class BatchItem:
+    image_id: int
+    stored_name: str
+    old_watermarked_name: str
+    new_watermarked_name: str
+    text: str
+
+
+@dataclass
+class _Batch:
+    job_id: int
+    user_id: int
+    total: int
+    ok: list[BatchItem] = field(default_factory=list)
+    failed: int = 0
+    # 写回前发现输出已被回收、重新提交过渲染的记录（只重试一次）
+    retried: set[int] = field(default_factory=set)
+
+    @property
+    def done(self) -> int:
+        return len(self.ok) + self.failed
+
+
+class WatermarkQueue:
+    # 水印渲染放到进程池中执行；images.status 本身就是持久化队列（pending 行在重启后重新入队）
+    def __init__(
+        self,
+        db_path: Path,
+        upload_dir: Path,
+        watermarked_dir: Path,
+        thumb_dir: Path,
+        *,
+        workers: int,
+        max_pending: int,
+    ) -> None:
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.watermarked_dir = watermarked_dir
+        self.thumb_dir = thumb_dir
+        self.workers = max(0, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._batches: dict[int, _Batch] = {}
+        # 批量任务结果写回后回调（参数为 user_id），用于使页面片段缓存失效
+        self.on_batch_done: Callable[[int], None] | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def submit(self, image_id: int, stored_name: str, watermarked_name: str, text: str, *, force: bool = False) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            if not force and self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            fut = self._pool().submit(
+                add_text_watermark,
+                self.upload_dir / stored_name,
+                self.watermarked_dir / watermarked_name,
+                text,
+            )
+        fut.add_done_callback(partial(self._done, int(image_id), watermarked_name))
+        return True
+
+    def _done(self, image_id: int, watermarked_name: str, fut: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+        # 渲染是先写临时文件再改名，失败不会留下目标文件（目标文件也可能被其他记录共享，不能删）
+        exc = None if fut.cancelled() else fut.exception()
+        if fut.cancelled() or exc is not None:
+            status, error = "failed", "cancelled" if fut.cancelled() else str(exc)[:500]
+        else:
+            status, error = "ready", ""
+            observe_render(fut.result())
+
+        conn = _connect(str(self.db_path))
+        try:
+            cur = conn.execute(
+                "UPDATE images SET status = ?, error = ? WHERE id = ? AND watermarked_name = ?",
+                (status, error, image_id, watermarked_name),
+            )
+            conn.commit()
+            if cur.rowcount == 0:
+                # 渲染期间记录已被删除或改写：删除时文件还不存在、没能回收，这里补做一次（仍被其他记录引用时保留）
+                with storage_lock():
+                    collect_garbage(
+                        conn,
+                        self.upload_dir,
+                        self.watermarked_dir,
+                        thumb_dir=self.thumb_dir,
+                        watermarked_names=[watermarked_name],
+                    )
+        finally:
+            conn.close()
+
+    def submit_batch(self, user_id: int, items: list[BatchItem], *, failed: int = 0) -> int:
+        # 相同（原图, 文字, 参数）的水印图已存在时无需重新渲染
+        todo, existing = [], []
+        for item in items:
+            (existing if (self.watermarked_dir / item.new_watermarked_name).exists() else todo).append(item)
+        # 与 submit 共用 WATERMARK_QUEUE_DEPTH：一次批量提交超过剩余容量时整体拒绝
+        reserved = len(todo) if self.enabled else 0
+        with self._lock:
+            if reserved and self._pending + reserved > self.max_pending:
+                raise QueueBusy()
+            self._pending += reserved
+
+        conn = _connect(str(self.db_path))
+        try:
+            cur = conn.execute(
+                "INSERT INTO jobs (user_id, kind, status, total, failed, created_at) VALUES (?, 'regenerate', 'running', ?, ?, ?)",
+                (user_id, len(items) + failed, failed, _now_iso()),
+            )
+            job_id = int(cur.lastrowid)
+            conn.commit()
+        except BaseException:
+            with self._lock:
+                self._pending -= reserved
+            raise
+        finally:
+            conn.close()
+
+        batch = _Batch(job_id=job_id, user_id=int(user_id), total=len(items) + failed, failed=failed)
+        with self._lock:
+            self._batches[job_id] = batch
+
+        for item in existing:
+            self._batch_item_done(batch, item, None)
+        if not items:
+            self._finish_batch(batch)
+        else:
+            self._render_batch(batch, todo, reserved=True)
+        return job_id
+
+    def _render_batch(self, batch: _Batch, items: list[BatchItem], *, reserved: bool) -> None:
+        if not self.enabled:
+            for item in items:
+                try:
+                    observe_render(
+                        add_text_watermark(
+                            self.upload_dir / item.stored_name,
+                            self.watermarked_dir / item.new_watermarked_name,
+                            item.text,
+                        )
+                    )
+                    exc = None
+                except Exception as e:
+                    exc = e
+                self._batch_item_done(batch, item, exc)
+            return
+        for item in items:
+            with self._lock:
+                if not reserved:
+                    self._pending += 1
+                fut = self._pool().submit(
+                    add_text_watermark,
+                    self.upload_dir / item.stored_name,
+                    self.watermarked_dir / item.new_watermarked_name,
+                    item.text,
+                )
+            fut.add_done_callback(partial(self._batch_future_done, batch, item))
+
+    def _batch_future_done(self, batch: _Batch, item: BatchItem, fut: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+        exc = Exception("cancelled") if fut.cancelled() else fut.exception()
+        if exc is None:
+            observe_render(fut.result())
+        self._batch_item_done(batch, item, exc)
+
+    def _batch_item_done(self, batch: _Batch, item: BatchItem, exc: BaseException | None) -> None:
+        with self._lock:
+            if exc is None:
+                batch.ok.append(item)
+            else:
+                batch.failed += 1
+            finished = batch.done >= batch.total
+        if finished:
+            self._finish_batch(batch)
+
+    def _finish_batch(self, batch: _Batch) -> None:
+        # 所有结果在一个事务里批量写回。新水印图在写回之前还没有 blob_refs 引用，
+        # 期间其他记录的删除/重新生成可能把这个共享文件回收掉：与上传一样在 storage_lock 下
+        # 复查文件、写回并回收。已消失的文件不在锁内渲染（这里是进程池的结果回调线程），
+        # 而是重新提交到进程池，渲染完成后再次进入这里
+        retry: list[BatchItem] = []
+        conn = _connect(str(self.db_path))
+        try:
+            with storage_lock():
+                missing = [it for it in batch.ok if not (self.watermarked_dir / it.new_watermarked_name).exists()]
+                retry = [it for it in missing if it.image_id not in batch.retried]
+                if missing:
+                    batch.ok = [it for it in batch.ok if it not in missing]
+                    batch.failed += len(missing) - len(retry)
+                if not retry:
+                    self._write_batch(conn, batch)
+        except Exception:
+            # 写回失败：记录保持原样，任务标记为 failed，而不是一直停在 running
+            retry = []
+            conn.rollback()
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', ok = 0, failed = ?, finished_at = ? WHERE id = ?",
+                (batch.total, _now_iso(), batch.job_id),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+            if not retry:
+                with self._lock:
+                    self._batches.pop(batch.job_id, None)
+
+        if retry:
+            batch.retried.update(it.image_id for it in retry)
+            self._render_batch(batch, retry, reserved=False)
+        elif self.on_batch_done is not None:
+            self.on_batch_done(batch.user_id)
+
+    def _write_batch(self, conn, batch: _Batch) -> None:
+        if batch.ok:
+            conn.executemany(
+                """
+                UPDATE images SET watermarked_name = ?, watermark_text = ?, status = 'ready', error = ''
+                WHERE id = ? AND user_id = ? AND watermarked_name = ?
+                """,
+                [(it.new_watermarked_name, it.text, it.image_id, batch.user_id, it.old_watermarked_name) for it in batch.ok],
+            )
+        conn.execute(
+            "UPDATE jobs SET status = 'done', ok = ?, failed = ?, finished_at = ? WHERE id = ?",
+            (len(batch.ok), batch.failed, _now_iso(), batch.job_id),
+        )
+        conn.commit()
+
+        # 旧水印图不再被引用时删除；记录已被删除/被其他任务改写时新文件也会被回收
+        collect_garbage(
+            conn,
+            self.upload_dir,
+            self.watermarked_dir,
+            thumb_dir=self.thumb_dir,
+            watermarked_names=[it.old_watermarked_name for it in batch.ok] + [it.new_watermarked_name for it in batch.ok],
+        )
+
+    def progress(self, job_id: int) -> dict | None:
+        with self._lock:
+            batch = self._batches.get(int(job_id))
+            if batch is None:
+                return None
+            return {"ok": len(batch.ok), "failed": batch.failed}
+
+    def resume(self) -> int:
+        conn = _connect(str(self.db_path))
+        try:
+            # 重启前未完成的批量任务：旧水印图仍然有效，直接标记为中断
+            conn.execute("UPDATE jobs SET status = 'interrupted' WHERE status = 'running'")
+            conn.commit()
+        finally:
+            conn.close()
+
+        if not self.enabled:
+            return 0
+        conn = _connect(str(self.db_path))
+        try:
+            rows = conn.execute(
+                "SELECT id, stored_name, watermarked_name, watermark_text FROM images WHERE status = 'pending' ORDER BY id"
+            ).fetchall()
+        finally:
+            conn.close()
+        for r in rows:
+            self.submit(r["id"], r["stored_name"], r["watermarked_name"], r["watermark_text"], force=True)
+        return len(rows)
+
+    def shutdown(self, wait: bool = True) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def init_watermark_queue(app) -> WatermarkQueue:
+    queue = WatermarkQueue(
+        Path(app.config["DB_PATH"]),
+        Path(app.config["UPLOAD_DIR"]),
+        Path(app.config["WATERMARKED_DIR"]),
+        Path(app.config["THUMB_DIR"]),
+        workers=app.config["WATERMARK_WORKERS"],
+        max_pending=app.config["WATERMARK_QUEUE_DEPTH"],
+    )
+    app.extensions["watermark_queue"] = queue
+    queue.resume()
+    atexit.register(queue.shutdown)
+    return queue
+
+
+def get_watermark_queue() -> WatermarkQueue:
+    return current_app.extensions["watermark_queue"]
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 import os
-import subprocess
 
-from flask import Blueprint, flash, g, redirect, render_template, request, url_for
+from flask import Blueprint, Response, flash, g, redirect, render_template, request, url_for
 
 from .auth import login_required
-from .db import fetch_many, get_db, log_action
+from .db import log_action
+from .probes import ProbeBusy, get_probe_executor, sse_events
+from .sandbox import SandboxLimit, get_lab_sandbox
 from .security import validate_hostname_or_ip
 
 bp = Blueprint("labs", __name__, url_prefix="/labs")
@@ -36,18 +37,18 @@ def sql_injection_insecure():
         "ORDER BY id DESC LIMIT 50"
     )
 
+    # 在内存沙箱（notes 表快照）中执行，不触及主库
     try:
-        cur = get_db().execute(sql)
-        rows = [dict(r) for r in cur.fetchall()]
+        rows, truncated = get_lab_sandbox().query(sql)
         err = None
     except Exception as e:
-        rows = []
+        rows, truncated = [], False
         err = str(e)
 
     log_action(g.user["id"], "lab_sql_injection_insecure", keyword)
     return render_template(
         "labs/sql_injection.html",
-        insecure={"keyword": keyword, "sql": sql, "rows": rows, "error": err},
+        insecure={"keyword": keyword, "sql": sql, "rows": rows, "truncated": truncated, "error": err},
         secure=None,
     )
 
@@ -64,12 +65,17 @@ def sql_injection_secure():
         "ORDER BY id DESC LIMIT 50"
     )
 
-    rows = fetch_many(sql, (like, like))
+    try:
+        rows, truncated = get_lab_sandbox().query(sql, (like, like))
+        err = None
+    except SandboxLimit as e:
+        rows, truncated = [], False
+        err = str(e)
     log_action(g.user["id"], "lab_sql_injection_secure", keyword)
     return render_template(
         "labs/sql_injection.html",
         insecure=None,
-        secure={"keyword": keyword, "sql": sql, "rows": rows, "error": None},
+        secure={"keyword": keyword, "sql": sql, "rows": rows, "truncated": truncated, "error": err},
     )
 
 
@@ -84,6 +90,15 @@ def _ping_cmd(host: str) -> list[str]:
     return ["ping", count_flag, "1", host]
 
 
+def _render_probe(kind: str, host: str, probe):
+    result = {"host": host, "cmd": probe.cmd, "probe_id": probe.id, "cached": probe.cached}
+    return render_template(
+        "labs/command_injection.html",
+        insecure=result if kind == "insecure" else None,
+        secure=result if kind == "secure" else None,
+    )
+
+
 @bp.post("/command-injection/insecure")
 @login_required
 def command_injection_insecure():
@@ -95,20 +110,13 @@ def command_injection_insecure():
     # 漏洞演示：shell=True + 拼接用户输入（仅用于实验演示）
     cmd = " ".join(_ping_cmd(host))
     try:
-        p = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=4)
-        out = (p.stdout + "\n" + p.stderr).strip()
-        out = out[:4000]
-        err = None
-    except Exception as e:
-        out = ""
-        err = str(e)
+        probe = get_probe_executor().submit(g.user["id"], cmd, shell=True)
+    except ProbeBusy:
+        flash("执行中的命令过多，请稍后重试", "warning")
+        return redirect(url_for("labs.command_injection_page"))
 
     log_action(g.user["id"], "lab_command_injection_insecure", host)
-    return render_template(
-        "labs/command_injection.html",
-        insecure={"host": host, "cmd": cmd, "output": out, "error": err},
-        secure=None,
-    )
+    return _render_probe("insecure", host, probe)
 
 
 @bp.post("/command-injection/secure")
@@ -119,20 +127,38 @@ def command_injection_secure():
         flash("host 格式不合法（仅允许域名或 IP）", "danger")
         return redirect(url_for("labs.command_injection_page"))
 
-    cmd = _ping_cmd(host)
+    # 校验通过的 host 结果相同，短时间内重复执行直接复用
     try:
-        p = subprocess.run(cmd, shell=False, capture_output=True, text=True, timeout=4)
-        out = (p.stdout + "\n" + p.stderr).strip()
-        out = out[:4000]
-        err = None
-    except Exception as e:
-        out = ""
-        err = str(e)
+        probe = get_probe_executor().submit(g.user["id"], _ping_cmd(host), shell=False, cache_key=host.lower())
+    except ProbeBusy:
+        flash("执行中的命令过多，请稍后重试", "warning")
+        return redirect(url_for("labs.command_injection_page"))
 
     log_action(g.user["id"], "lab_command_injection_secure", host)
-    return render_template(
-        "labs/command_injection.html",
-        insecure=None,
-        secure={"host": host, "cmd": " ".join(cmd), "output": out, "error": err},
-    )
+    return _render_probe("secure", host, probe)
+
 
+@bp.get("/command-injection/probes/<probe_id>")
+@login_required
+def command_injection_stream(probe_id: str):
+    executor = get_probe_executor()
+    probe = executor.get(probe_id)
+    if probe is None or probe.user_id != g.user["id"]:
+        return {"error": "not found"}, 404
+    try:
+        offset = max(0, int(request.headers.get("Last-Event-ID") or 0))
+    except ValueError:
+        offset = 0
+
+    # 同时保持的输出流有上限：拿不到名额时只返回已有输出（浏览器随后自动重连），不占住工作线程等待
+    held = executor.streams.acquire(blocking=False)
+
+    resp = Response(
+        sse_events(probe, offset, hold=executor.timeout + 1 if held else 0),
+        content_type="text/event-stream; charset=utf-8",
+    )
+    if held:
+        resp.call_on_close(executor.streams.release)
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
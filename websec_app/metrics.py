@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from flask import Response, current_app, g, request
+
+# 请求耗时直方图的桶边界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RENDER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_ENDPOINT_KEY = "websec.endpoint"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+@dataclass
+class RequestStats:
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    render_seconds: float = 0.0
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("websec_request_stats", default=None)
+
+
+# 进程内汇总：按 endpoint 的耗时直方图与请求数、SQL 次数与耗时、水印渲染耗时、文件发送字节数
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latency: dict[str, Histogram] = {}
+        self.responses: dict[tuple[str, int], int] = {}
+        self.db_queries: dict[str, int] = {}
+        self.db_seconds: dict[str, float] = {}
+        self.render = Histogram(RENDER_BUCKETS)
+        self.bytes_served: dict[str, int] = {}
+
+    def observe_request(self, endpoint: str, status: int, seconds: float, stats: RequestStats) -> None:
+        with self._lock:
+            hist = self.latency.get(endpoint)
+            if hist is None:
+                hist = self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+            hist.observe(seconds)
+            key = (endpoint, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            self.db_queries[endpoint] = self.db_queries.get(endpoint, 0) + stats.db_queries
+            self.db_seconds[endpoint] = self.db_seconds.get(endpoint, 0.0) + stats.db_seconds
+
+    def observe_render(self, seconds: float) -> None:
+        with self._lock:
+            self.render.observe(seconds)
+
+    def add_bytes(self, kind: str, n: int) -> None:
+        with self._lock:
+            self.bytes_served[kind] = self.bytes_served.get(kind, 0) + int(n)
+
+
+REGISTRY = Registry()
+
+
+def record_db(seconds: float, *, count: bool = True) -> None:
+    stats = _current.get()
+    if stats is not None:
+        if count:
+            stats.db_queries += 1
+        stats.db_seconds += seconds
+
+
+def observe_render(seconds: float | None) -> None:
+    if seconds is None:
+        return
+    REGISTRY.observe_render(seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.render_seconds += seconds
+
+
+def add_bytes_served(kind: str, n: int | None) -> None:
+    if n:
+        REGISTRY.add_bytes(kind, n)
+
+
+class MetricsMiddleware:
+    # 计时到应用返回响应为止（不含响应体发送）；响应体迭代器原样返回——
+    # send_file 的 wsgi.file_wrapper 必须直接交给 waitress，包一层就会退化为在工作线程里逐块读文件
+    def __init__(self, wsgi_app, registry: Registry = REGISTRY) -> None:
+        self.wsgi_app = wsgi_app
+        self.registry = registry
+
+    def __call__(self, environ, start_response):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status_code = [0]
+
+        def _start_response(status, headers, exc_info=None):
+            status_code[0] = int(status.split(" ", 1)[0])
+            elapsed = time.perf_counter() - start
+            timing = [
+                f"app;dur={elapsed * 1000:.1f}",
+                f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_queries} queries"',
+            ]
+            if stats.render_seconds:
+                timing.append(f"wm;dur={stats.render_seconds * 1000:.1f}")
+            headers = list(headers) + [("Server-Timing", ", ".join(timing))]
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, _start_response)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            endpoint = environ.get(_ENDPOINT_KEY) or "unmatched"
+            self.registry.observe_request(endpoint, status_code[0], elapsed, stats)
+
+
+def tag_endpoint() -> None:
+    # before_request：把 Flask endpoint 名记到 environ，供中间件按 endpoint 汇总
+    request.environ[_ENDPOINT_KEY] = request.endpoint or "unmatched"
+
+
+def _label(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(name: str, hist: Histogram, labels: str = "") -> list[str]:
+    sep = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, n in zip(hist.buckets, hist.counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {hist.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {hist.sum:.6f}")
+    lines.append(f"{name}_count{suffix} {hist.count}")
+    return lines
+
+
+def _gauges() -> dict[str, tuple[str, float]]:
+    ext = current_app.extensions
+    out: dict[str, tuple[str, float]] = {}
+    queue = ext.get("watermark_queue")
+    if queue is not None:
+        out["websec_watermark_pending"] = ("Watermark renders queued or running", queue.pending)
+    pool = ext.get("db_pool")
+    if pool is not None:
+        out["websec_db_connections_created_total"] = ("SQLite connections opened by the pool", pool.created)
+        out["websec_db_connections_reused_total"] = ("SQLite connections reused from the pool", pool.reused)
+    cache = ext.get("user_cache")
+    if cache is not None:
+        out["websec_user_cache_hits_total"] = ("User cache hits", cache.hits)
+        out["websec_user_cache_misses_total"] = ("User cache misses", cache.misses)
+    hasher = ext.get("password_hasher")
+    if hasher is not None:
+        stats = hasher.stats()
+        out["websec_password_hash_pending"] = ("Password hashes queued or running", stats["pending"])
+        out["websec_password_hash_rejected_total"] = ("Password hashes rejected (queue full)", stats["rejected"])
+    writer = ext.get("audit_writer")
+    if writer is not None:
+        stats = writer.stats()
+        out["websec_audit_pending"] = ("Audit events waiting to be written", stats["pending"])
+        out["websec_audit_dropped_total"] = ("Audit events dropped", stats["dropped"])
+    throttle = ext.get("login_throttle")
+    if throttle is not None:
+        out["websec_login_throttled_total"] = ("Login attempts rejected by throttling", throttle.rejected)
+    probes = ext.get("probe_executor")
+    if probes is not None:
+        stats = probes.stats()
+        out["websec_probe_pending"] = ("Lab probes queued or running", stats["pending"])
+        out["websec_probe_rejected_total"] = ("Lab probes rejected (limits reached)", stats["rejected"])
+        out["websec_probe_cache_hits_total"] = ("Lab probe results served from cache", stats["cache_hits"])
+    fragments = ext.get("fragment_cache")
+    if fragments is not None:
+        out["websec_fragment_cache_hits_total"] = ("Page fragment cache hits", fragments.hits)
+        out["websec_fragment_cache_misses_total"] = ("Page fragment cache misses", fragments.misses)
+    sandbox = ext.get("lab_sandbox")
+    if sandbox is not None:
+        stats = sandbox.stats()
+        out["websec_lab_sql_queries_total"] = ("SQL lab queries run in the sandbox", stats["queries"])
+        out["websec_lab_sql_aborted_total"] = ("SQL lab queries aborted by limits", stats["aborted"])
+    return out
+
+
+def render_prometheus(registry: Registry = REGISTRY) -> str:
+    lines: list[str] = []
+    with registry._lock:
+        lines += [
+            "# HELP websec_request_duration_seconds Time until the application returned a response",
+            "# TYPE websec_request_duration_seconds histogram",
+        ]
+        for endpoint, hist in sorted(registry.latency.items()):
+            lines += _histogram_lines("websec_request_duration_seconds", hist, f'endpoint="{_label(endpoint)}"')
+
+        lines += ["# HELP websec_responses_total Responses by endpoint and status", "# TYPE websec_responses_total counter"]
+        for (endpoint, status), n in sorted(registry.responses.items()):
+            lines.append(f'websec_responses_total{{endpoint="{_label(endpoint)}",status="{status}"}} {n}')
+
+        lines += ["# HELP websec_db_queries_total SQL statements executed", "# TYPE websec_db_queries_total counter"]
+        for endpoint, n in sorted(registry.db_queries.items()):
+            lines.append(f'websec_db_queries_total{{endpoint="{_label(endpoint)}"}} {n}')
+
+        lines += ["# HELP websec_db_seconds_total Time spent in SQLite", "# TYPE websec_db_seconds_total counter"]
+        for endpoint, n in sorted(registry.db_seconds.items()):
+            lines.append(f'websec_db_seconds_total{{endpoint="{_label(endpoint)}"}} {n:.6f}')
+
+        lines += ["# HELP websec_watermark_render_seconds Watermark render time", "# TYPE websec_watermark_render_seconds histogram"]
+        lines += _histogram_lines("websec_watermark_render_seconds", registry.render)
+
+        lines += ["# HELP websec_file_bytes_total Bytes of stored files sent", "# TYPE websec_file_bytes_total counter"]
+        for kind, n in sorted(registry.bytes_served.items()):
+            lines.append(f'websec_file_bytes_total{{mode="{_label(kind)}"}} {n}')
+
+    for name, (help_text, value) in _gauges().items():
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    # 管理员会话始终可以访问；设置 METRICS_TOKEN 时也可用 Bearer token 访问（供 Prometheus 抓取）
+    if not (getattr(g, "user", None) and g.user.get("is_admin")):
+        token = current_app.config.get("METRICS_TOKEN") or ""
+        if not token:
+            return {"error": "forbidden"}, 403
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return {"error": "unauthorized"}, 401
+    resp = Response(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+def init_metrics(app) -> None:
+    app.before_request(tag_endpoint)
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+    app.add_url_rule("/api/metrics", "api_metrics", metrics_view)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _method_of(password_hash: str) -> str:
+    return password_hash.split("$", 1)[0]
+
+
+# 密码哈希（scrypt/PBKDF2）是纯 CPU 计算：放到独立的有界进程池中执行，不占用 GIL。
+# 提交任务的请求线程仍要等结果返回，因此进行中的任务数限制为 max_pending（默认为进程数 + 1），
+# 超出时直接拒绝，登录高峰最多占住这几个请求线程，其余线程照常处理预览、缩略图等请求。
+class PasswordHasher:
+    def __init__(self, *, method: str, salt_length: int, workers: int, max_pending: int) -> None:
+        self.method = method
+        self.salt_length = max(8, int(salt_length))
+        self.workers = max(0, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # 参数的完整形式（如 pbkdf2 -> pbkdf2:sha256:1000000），用于判断旧哈希是否需要升级
+        self.current_method = _method_of(generate_password_hash("", method=method, salt_length=self.salt_length))
+
+        self.submitted = 0
+        self.rejected = 0
+        self.max_pending_seen = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "max_pending_seen": self.max_pending_seen,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusy()
+            self._pending += 1
+            self.submitted += 1
+            self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        start = time.perf_counter()
+        try:
+            if not self.workers:
+                return fn(*args, **kwargs)
+            return self._pool().submit(fn, *args, **kwargs).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.busy_seconds += time.perf_counter() - start
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, method=self.method, salt_length=self.salt_length)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return bool(self._run(check_password_hash, password_hash, password))
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return _method_of(password_hash) != self.current_method
+
+    def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def init_password_hasher(app) -> PasswordHasher:
+    hasher = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        salt_length=app.config["PASSWORD_SALT_LENGTH"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_pending=app.config["PASSWORD_HASH_QUEUE_DEPTH"] or max(0, app.config["PASSWORD_HASH_WORKERS"]) + 1,
+    )
+    app.extensions["password_hasher"] = hasher
+    atexit.register(hasher.shutdown)
+    return hasher
+
+
+def get_password_hasher() -> PasswordHasher:
+    return current_app.extensions["password_hasher"]
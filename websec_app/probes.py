@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
+import codecs
+import json
+import locale
+import os
+import secrets
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+# 已结束的探测结果保留多久（秒），供页面重连 / 刷新后继续读取
+_FINISHED_KEEP = 120.0
+
+
+class ProbeBusy(Exception):
+    pass
+
+
+class Probe:
+    def __init__(self, user_id: int, cmd: str) -> None:
+        self.id = secrets.token_urlsafe(12)
+        self.user_id = user_id
+        self.cmd = cmd
+        self.chunks: list[str] = []
+        self.size = 0
+        self.truncated = False
+        self.done = False
+        self.returncode: int | None = None
+        self.error: str | None = None
+        self.cached = False
+        self.finished_at = 0.0
+        self._cond = threading.Condition()
+
+    def append(self, text: str, limit: int) -> None:
+        with self._cond:
+            room = limit - self.size
+            if room <= 0:
+                self.truncated = True
+                return
+            if len(text) > room:
+                text = text[:room]
+                self.truncated = True
+            self.chunks.append(text)
+            self.size += len(text)
+            self._cond.notify_all()
+
+    def finish(self, returncode: int | None, error: str | None) -> None:
+        with self._cond:
+            self.returncode = returncode
+            self.error = error
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def wait(self, offset: int, timeout: float) -> tuple[list[str], bool]:
+        # 返回 offset 之后的新输出；没有新输出且未结束时最多等待 timeout 秒
+        with self._cond:
+            if len(self.chunks) <= offset and not self.done:
+                self._cond.wait(timeout)
+            return self.chunks[offset:], self.done
+
+    @property
+    def output(self) -> str:
+        return "".join(self.chunks)
+
+    def result(self) -> dict:
+        return {
+            "returncode": self.returncode,
+            "error": self.error,
+            "truncated": self.truncated,
+            "cached": self.cached,
+        }
+
+
+# 命令注入实验的探测执行器：子进程由后台线程中的 asyncio 事件循环驱动，请求线程只负责提交，
+# 输出经 SSE 增量返回。全局并发（max_concurrent）、排队（max_queue）与单用户未完成数（per_user）
+# 均有上限，超出时直接拒绝；一个教室同时点“执行”也不会占满 waitress 的工作线程。
+# 防御版的结果按（已校验的）host 做短时缓存。
+class ProbeExecutor:
+    def __init__(
+        self,
+        *,
+        max_concurrent: int,
+        max_queue: int,
+        per_user: int,
+        timeout: float,
+        max_output: int,
+        cache_seconds: float,
+        max_streams: int,
+    ) -> None:
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.per_user = max(1, int(per_user))
+        self.timeout = max(0.5, float(timeout))
+        self.max_output = max(256, int(max_output))
+        self.cache_seconds = max(0.0, float(cache_seconds))
+        self.encoding = locale.getpreferredencoding(False) or "utf-8"
+        self._lock = threading.Lock()
+        self._probes: dict[str, Probe] = {}
+        self._active: dict[int, int] = {}
+        self._cache: OrderedDict[str, tuple[float, Probe]] = OrderedDict()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._sem: asyncio.Semaphore | None = None
+        # 同时保持连接的输出流数；超出时只返回当前已有输出，由浏览器 1 秒后重连续读
+        self.streams = threading.BoundedSemaphore(max(1, int(max_streams)))
+
+        self.started = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(self._active.values())
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "started": self.started,
+            "rejected": self.rejected,
+            "cache_hits": self.cache_hits,
+            "timeouts": self.timeouts,
+        }
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run() -> None:
+                asyncio.set_event_loop(loop)
+                self._sem = asyncio.Semaphore(self.max_concurrent)
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="probe-loop", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+        return self._loop
+
+    def _prune(self, now: float) -> None:
+        dead = [pid for pid, p in self._probes.items() if p.done and now - p.finished_at > _FINISHED_KEEP]
+        for pid in dead:
+            del self._probes[pid]
+        while self._cache and next(iter(self._cache.values()))[0] <= now:
+            self._cache.popitem(last=False)
+
+    def get(self, probe_id: str) -> Probe | None:
+        with self._lock:
+            return self._probes.get(probe_id)
+
+    def submit(self, user_id: int, cmd: str | list[str], *, shell: bool, cache_key: str | None = None) -> Probe:
+        display = cmd if isinstance(cmd, str) else " ".join(cmd)
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if cache_key is not None:
+                hit = self._cache.get(cache_key)
+                if hit is not None:
+                    self.cache_hits += 1
+                    probe = Probe(user_id, display)
+                    probe.chunks = list(hit[1].chunks)
+                    probe.size = hit[1].size
+                    probe.truncated = hit[1].truncated
+                    probe.cached = True
+                    probe.finish(hit[1].returncode, hit[1].error)
+                    self._probes[probe.id] = probe
+                    return probe
+            if self.pending >= self.max_concurrent + self.max_queue or self._active.get(user_id, 0) >= self.per_user:
+                self.rejected += 1
+                raise ProbeBusy()
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+            self.started += 1
+            probe = Probe(user_id, display)
+            self._probes[probe.id] = probe
+        asyncio.run_coroutine_threadsafe(self._run(probe, cmd, shell, cache_key), self._ensure_loop())
+        return probe
+
+    async def _run(self, probe: Probe, cmd: str | list[str], shell: bool, cache_key: str | None) -> None:
+        returncode = None
+        error = None
+        try:
+            async with self._sem:
+                # 独立进程组：超时时连同 shell 派生的子进程一起结束（否则子进程占着管道，读不到 EOF）
+                kwargs = {"stdout": asyncio.subprocess.PIPE, "stderr": asyncio.subprocess.STDOUT}
+                if os.name != "nt":
+                    kwargs["start_new_session"] = True
+                if shell:
+                    proc = await asyncio.create_subprocess_shell(cmd, **kwargs)
+                else:
+                    proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+                try:
+                    await asyncio.wait_for(self._pump(probe, proc), self.timeout)
+                    returncode = proc.returncode
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    error = f"执行超时（{self.timeout:g} 秒）"
+                    _kill(proc)
+                    await proc.wait()
+        except Exception as e:
+            error = str(e)
+        finally:
+            probe.finish(returncode, error)
+            with self._lock:
+                n = self._active.get(probe.user_id, 1) - 1
+                if n > 0:
+                    self._active[probe.user_id] = n
+                else:
+                    self._active.pop(probe.user_id, None)
+                if cache_key is not None and self.cache_seconds and error is None:
+                    self._cache[cache_key] = (time.monotonic() + self.cache_seconds, probe)
+                    self._cache.move_to_end(cache_key)
+
+    async def _pump(self, probe: Probe, proc: asyncio.subprocess.Process) -> None:
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        while True:
+            data = await proc.stdout.read(1024)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                probe.append(text, self.max_output)
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            probe.append(tail, self.max_output)
+        await proc.wait()
+
+    def shutdown(self) -> None:
+        loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            if self._thread is not None:
+                self._thread.join(timeout=2)
+
+
+def _kill(proc: asyncio.subprocess.Process) -> None:
+    try:
+        if os.name == "nt":
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def sse_events(probe: Probe, offset: int, *, hold: float):
+    # SSE：每段输出一个 output 事件（id 为已发送的段数，断线重连时浏览器通过 Last-Event-ID 续传），
+    # 结束时发送 done 事件。hold=0 时只返回当前已有的输出，并让浏览器 1 秒后重连。
+    yield "retry: 1000\n\n"
+    deadline = time.monotonic() + hold
+    while True:
+        remaining = deadline - time.monotonic()
+        chunks, done = probe.wait(offset, max(0.0, min(remaining, 15.0)))
+        for text in chunks:
+            offset += 1
+            yield f"id: {offset}\nevent: output\ndata: {json.dumps(text, ensure_ascii=False)}\n\n"
+        if done and len(probe.chunks) <= offset:
+            yield f"event: done\ndata: {json.dumps(probe.result(), ensure_ascii=False)}\n\n"
+            return
+        if remaining <= 0:
+            return
+
+
+def init_probe_executor(app) -> ProbeExecutor:
+    executor = ProbeExecutor(
+        max_concurrent=app.config["PROBE_MAX_CONCURRENT"],
+        max_queue=app.config["PROBE_QUEUE_DEPTH"],
+        per_user=app.config["PROBE_PER_USER"],
+        timeout=app.config["PROBE_TIMEOUT"],
+        max_output=app.config["PROBE_MAX_OUTPUT"],
+        cache_seconds=app.config["PROBE_CACHE_SECONDS"],
+        max_streams=app.config["PROBE_MAX_STREAMS"],
+    )
+    app.extensions["probe_executor"] = executor
+    atexit.register(executor.shutdown)
+    return executor
+
+
+def get_probe_executor() -> ProbeExecutor:
+    return current_app.extensions["probe_executor"]
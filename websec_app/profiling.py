@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import cProfile
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    flash,
+    g,
+    redirect,
+    render_template,
+    request,
+    send_from_directory,
+    url_for,
+)
+
+from .auth import admin_required
+
+bp = Blueprint("profiling", __name__, url_prefix="/admin/profiles")
+
+MODES = ("cprofile", "sample")
+_NAME_RE = re.compile(r"^[\w.-]+\.(pstats|collapsed)$")
+
+
+@dataclass
+class ProfileRules:
+    enabled: bool = False
+    endpoints: tuple[str, ...] = ()
+    rate: float = 1.0
+    mode: str = "cprofile"
+
+
+# 采样模式：后台线程按固定间隔读取请求线程的调用栈，输出 collapsed-stack（可直接用 flamegraph.pl / speedscope 查看）。
+# 开销与请求本身的调用次数无关，适合分析慢请求的大致热点；cProfile 则给出精确的调用次数与耗时。
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{Path(code.co_filename).name}:{code.co_name}")
+            frame = frame.f_back
+        if parts:
+            self.stacks[";".join(reversed(parts))] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path: Path) -> None:
+        path.write_text("".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common()), encoding="utf-8")
+
+
+@dataclass
+class Profiler:
+    directory: Path
+    sample_interval: float
+    keep: int
+    max_active: int
+    rules: ProfileRules = field(default_factory=ProfileRules)
+    active: int = 0
+    _cprofile_busy: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def _wanted(self) -> str | None:
+        endpoint = request.endpoint or ""
+        if endpoint in ("static", "assets") or endpoint.startswith("profiling."):
+            return None
+        # 管理员可通过请求头对单个请求做剖析：X-Profile: cprofile / sample
+        header = (request.headers.get("X-Profile") or "").strip().lower()
+        if header and getattr(g, "user", None) and g.user.get("is_admin"):
+            return header if header in MODES else self.rules.mode
+        rules = self.rules
+        if not rules.enabled:
+            return None
+        if rules.endpoints and endpoint not in rules.endpoints:
+            return None
+        if random.random() >= rules.rate:
+            return None
+        return rules.mode
+
+    def begin(self) -> None:
+        mode = self._wanted()
+        if mode is None:
+            return
+        with self._lock:
+            if self.active >= self.max_active:
+                return
+            # cProfile 作用于整个解释器（3.12+ 基于 sys.monitoring，同时只能有一个）：
+            # 已有 cProfile 会话时退回采样模式，否则会互相混入对方线程的调用，第二个 enable() 还会直接报错
+            if mode == "cprofile" and self._cprofile_busy:
+                mode = "sample"
+            self.active += 1
+            if mode == "cprofile":
+                self._cprofile_busy = True
+        g._profile_slot = mode
+        if mode == "sample":
+            prof = StackSampler(threading.get_ident(), self.sample_interval)
+            prof.start()
+        else:
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError as e:
+                # 其他剖析/调试工具占用了 sys.monitoring：本次请求不剖析
+                current_app.logger.warning("cProfile unavailable: %s", e)
+                self._release(g.pop("_profile_slot"))
+                return
+        g._profile = (mode, prof, time.perf_counter())
+
+    def _release(self, mode: str) -> None:
+        with self._lock:
+            self.active -= 1
+            if mode == "cprofile":
+                self._cprofile_busy = False
+
+    def end(self, _exc: BaseException | None = None) -> None:
+        slot = g.pop("_profile_slot", None)
+        if slot is None:
+            return
+        try:
+            state = g.pop("_profile", None)
+            if state is None:
+                return
+            mode, prof, start = state
+            if mode == "cprofile":
+                prof.disable()
+            else:
+                prof.stop()
+            elapsed_ms = int((time.perf_counter() - start) * 1000)
+            endpoint = re.sub(r"[^\w.-]", "_", request.endpoint or "unmatched")
+            suffix = "pstats" if mode == "cprofile" else "collapsed"
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{elapsed_ms}ms-{secrets.token_hex(3)}.{suffix}"
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if mode == "cprofile":
+                prof.dump_stats(str(self.directory / name))
+            else:
+                prof.dump(self.directory / name)
+            self._prune()
+        finally:
+            self._release(slot)
+
+    def _prune(self) -> None:
+        files = sorted(self.files(), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in files[self.keep :]:
+            old.unlink(missing_ok=True)
+
+    def files(self) -> list[Path]:
+        if not self.directory.exists():
+            return []
+        return [p for p in self.directory.iterdir() if _NAME_RE.match(p.name)]
+
+
+def init_profiling(app) -> Profiler:
+    profiler = Profiler(
+        directory=Path(app.config["PROFILE_DIR"]),
+        sample_interval=max(1, app.config["PROFILE_SAMPLE_MS"]) / 1000,
+        keep=max(1, app.config["PROFILE_KEEP"]),
+        max_active=max(1, app.config["PROFILE_MAX_ACTIVE"]),
+    )
+    app.extensions["profiler"] = profiler
+    app.before_request(profiler.begin)
+    app.teardown_request(profiler.end)
+    return profiler
+
+
+def _profiler() -> Profiler:
+    return current_app.extensions["profiler"]
+
+
+@bp.get("/")
+@admin_required
+def index():
+    profiler = _profiler()
+    files = []
+    for p in sorted(profiler.files(), key=lambda p: p.stat().st_mtime, reverse=True):
+        st = p.stat()
+        mtime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(st.st_mtime))
+        files.append({"name": p.name, "size": st.st_size, "mtime": mtime})
+    return render_template("profiles.html", rules=profiler.rules, files=files, modes=MODES)
+
+
+@bp.post("/rules")
+@admin_required
+def rules_post():
+    try:
+        rate = float(request.form.get("rate") or 1)
+    except ValueError:
+        rate = 1.0
+    mode = request.form.get("mode") or "cprofile"
+    endpoints = tuple(e for e in re.split(r"[\s,]+", request.form.get("endpoints") or "") if e)
+    _profiler().rules = ProfileRules(
+        enabled=bool(request.form.get("enabled")),
+        endpoints=endpoints,
+        rate=min(1.0, max(0.0, rate)),
+        mode=mode if mode in MODES else "cprofile",
+    )
+    flash("剖析规则已更新", "success")
+    return redirect(url_for("profiling.index"))
+
+
+@bp.get("/<name>")
+@admin_required
+def download(name: str):
+    if not _NAME_RE.match(name):
+        abort(404)
+    return send_from_directory(_profiler().directory, name, as_attachment=True)
+
+
+@bp.post("/clear")
+@admin_required
+def clear():
+    for p in _profiler().files():
+        p.unlink(missing_ok=True)
+    flash("已清空剖析文件", "info")
+    return redirect(url_for("profiling.index"))
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from flask import current_app
+
+from .db import _connect
+
+_PROGRESS_EVERY = 1000
+
+
+class SandboxLimit(Exception):
+    pass
+
+
+# SQL 注入实验的沙箱库：每个工作线程一份内存 SQLite，只包含 notes 表的快照。
+# 实验 SQL（含注入后的任意 SELECT）只在这份副本上执行，不会占用主库的锁与页缓存；
+# 执行期间由 progress handler 检查 VM 指令预算与墙钟时间，超限即中止，结果行数也有上限。
+# 快照序列化为字节串后共享，连接用满 recycle_after 次或快照过期时用 deserialize 重置。
+class LabSandbox:
+    def __init__(
+        self,
+        db_path: Path,
+        *,
+        max_steps: int,
+        timeout_ms: int,
+        max_rows: int,
+        recycle_after: int,
+        snapshot_seconds: float,
+    ) -> None:
+        self.db_path = db_path
+        self.max_steps = max(_PROGRESS_EVERY, int(max_steps))
+        self.timeout = max(10, int(timeout_ms)) / 1000
+        self.max_rows = max(1, int(max_rows))
+        self.recycle_after = max(1, int(recycle_after))
+        self.snapshot_seconds = max(0.0, float(snapshot_seconds))
+        self._lock = threading.Lock()
+        self._snapshot: bytes | None = None
+        self._snapshot_version = 0
+        self._snapshot_at = 0.0
+        self._local = threading.local()
+
+        self.queries = 0
+        self.aborted = 0
+        self.recycled = 0
+
+    def _build_snapshot(self) -> bytes:
+        src = _connect(str(self.db_path))
+        try:
+            schema = src.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'notes'").fetchone()
+            rows = src.execute("SELECT * FROM notes").fetchall()
+        finally:
+            src.close()
+        mem = sqlite3.connect(":memory:")
+        try:
+            mem.execute(schema["sql"])
+            if rows:
+                marks = ", ".join("?" * len(rows[0]))
+                mem.executemany(f"INSERT INTO notes VALUES ({marks})", [tuple(r) for r in rows])
+            mem.commit()
+            return mem.serialize()
+        finally:
+            mem.close()
+
+    def _current_snapshot(self) -> tuple[bytes, int]:
+        now = time.monotonic()
+        with self._lock:
+            expired = self.snapshot_seconds and now - self._snapshot_at >= self.snapshot_seconds
+            if self._snapshot is None or expired:
+                self._snapshot = self._build_snapshot()
+                self._snapshot_version += 1
+                self._snapshot_at = now
+            return self._snapshot, self._snapshot_version
+
+    def _conn(self) -> sqlite3.Connection:
+        local = self._local
+        snapshot, version = self._current_snapshot()
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # 禁止 ATTACH（否则可以挂载主库文件）；限制单个字符串/BLOB 与 SQL 长度
+            conn.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, 0)
+            conn.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, 1_000_000)
+            conn.setlimit(sqlite3.SQLITE_LIMIT_SQL_LENGTH, 100_000)
+            conn.set_progress_handler(self._progress, _PROGRESS_EVERY)
+            local.conn = conn
+            local.version = 0
+        if local.version != version or local.uses >= self.recycle_after or conn.total_changes != local.changes:
+            if local.version:
+                self.recycled += 1
+            conn.deserialize(snapshot)
+            conn.execute("PRAGMA query_only = ON")
+            local.version = version
+            local.uses = 0
+            local.changes = conn.total_changes
+        local.uses += 1
+        return conn
+
+    def _progress(self) -> int:
+        local = self._local
+        local.steps += _PROGRESS_EVERY
+        if local.steps > self.max_steps:
+            local.reason = f"超出执行预算（{self.max_steps} 条 VM 指令）"
+            return 1
+        if time.perf_counter() > local.deadline:
+            local.reason = f"执行超时（{self.timeout * 1000:g} ms）"
+            return 1
+        return 0
+
+    def query(self, sql: str, params: tuple = ()) -> tuple[list[dict], bool]:
+        local = self._local
+        local.steps = 0
+        local.reason = None
+        local.deadline = time.perf_counter() + self.timeout
+        conn = self._conn()
+        self.queries += 1
+        try:
+            cur = conn.execute(sql, params)
+            rows = cur.fetchmany(self.max_rows + 1)
+            cur.close()
+        except sqlite3.OperationalError as e:
+            if local.reason:
+                self.aborted += 1
+                raise SandboxLimit(f"查询已中止：{local.reason}") from e
+            raise
+        truncated = len(rows) > self.max_rows
+        return [dict(r) for r in rows[: self.max_rows]], truncated
+
+    def stats(self) -> dict:
+        return {"queries": self.queries, "aborted": self.aborted, "recycled": self.recycled}
+
+
+def init_lab_sandbox(app) -> LabSandbox:
+    sandbox = LabSandbox(
+        Path(app.config["DB_PATH"]),
+        max_steps=app.config["LAB_SQL_MAX_STEPS"],
+        timeout_ms=app.config["LAB_SQL_TIMEOUT_MS"],
+        max_rows=app.config["LAB_SQL_MAX_ROWS"],
+        recycle_after=app.config["LAB_SQL_RECYCLE"],
+        snapshot_seconds=app.config["LAB_SQL_SNAPSHOT_SECONDS"],
+    )
+    app.extensions["lab_sandbox"] = sandbox
+    return sandbox
+
+
+def get_lab_sandbox() -> LabSandbox:
+    return current_app.extensions["lab_sandbox"]
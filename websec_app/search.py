@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from flask import current_app
+from markupsafe import Markup, escape
+
+from .db import get_db
+
+# images_fts 使用 trigram 分词：任意 ≥3 个字符的子串都能命中，语义与原来的 LIKE '%q%' 一致，
+# 同时支持中文文件名/水印文字；更短的关键词仍退回 LIKE。
+MIN_TERM_CHARS = 3
+
+# highlight()/snippet() 使用控制字符作为标记，转义后再替换成 <mark>，避免用户文件名注入 HTML
+HL_START = "\x02"
+HL_END = "\x03"
+
+_fts_state: dict[str, bool] = {}
+
+
+def fts_enabled() -> bool:
+    db_path = current_app.config["DB_PATH"]
+    if db_path not in _fts_state:
+        row = get_db().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'"
+        ).fetchone()
+        _fts_state[db_path] = row is not None
+    return _fts_state[db_path]
+
+
+def build_match_query(q: str) -> str | None:
+    terms = q.split()
+    if not terms or not fts_enabled():
+        return None
+    if any(len(t) < MIN_TERM_CHARS for t in terms):
+        return None
+    # 每个词作为短语（双引号转义），多个词之间为 AND
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def highlight_html(value: str | None) -> Markup:
+    text = escape(value or "")
+    return Markup(str(text).replace(HL_START, "<mark>").replace(HL_END, "</mark>"))
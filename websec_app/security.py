@@ -12,15 +12,20 @@ from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.x509.oid import NameOID
 from flask import abort, current_app, request, session
-from werkzeug.security import check_password_hash, generate_password_hash
+
+from .passwords import get_password_hasher
 
 
 def hash_password(password: str) -> str:
-    return generate_password_hash(password)
+    return get_password_hasher().hash(password)
 
 
 def verify_password(password_hash: str, password: str) -> bool:
-    return check_password_hash(password_hash, password)
+    return get_password_hasher().verify(password_hash, password)
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    return get_password_hasher().needs_rehash(password_hash)
 
 
 def csrf_token() -> str:
@@ -42,8 +47,15 @@ def require_csrf() -> None:
         abort(400, description="Bad CSRF token")
 
 
-def set_session_logged_in(user_id: int) -> None:
+def reset_session() -> None:
     session.clear()
+    # 服务端会话：登录/登出时更换 sid（旧 sid 作废）
+    if hasattr(session, "regenerate"):
+        session.regenerate()
+
+
+def set_session_logged_in(user_id: int) -> None:
+    reset_session()
     session["user_id"] = int(user_id)
     session["login_at"] = datetime.now(timezone.utc).isoformat()
     session.permanent = True
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from .db import _connect
+
+_SID_RE = re.compile(r"^[A-Za-z0-9_-]{32}$")
+
+
+def _new_sid() -> str:
+    # 24 字节随机数（192 位），本身不可猜测，cookie 中只放这个 id，无需签名
+    return secrets.token_urlsafe(24)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial: dict | None = None, *, sid: str | None = None, expires: float = 0.0) -> None:
+        def on_update(self) -> None:
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.previous_sid: str | None = None
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def regenerate(self) -> None:
+        # 登录等权限变化时更换 sid，旧 sid 在保存时删除（防止会话固定）
+        if self.sid and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class MemorySessionStore:
+    # 进程内 LRU：适合单进程部署（waitress 默认即单进程多线程），重启后会话失效
+    def __init__(self, *, max_entries: int = 10000) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self._data: OrderedDict[str, tuple[float, int | None, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid: str, now: float) -> tuple[str, float] | None:
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return entry[2], entry[0]
+
+    def save(self, sid: str, user_id: int | None, data: str, expires: float) -> None:
+        with self._lock:
+            self._data[sid] = (expires, user_id, data)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def delete_user(self, user_id: int) -> int:
+        with self._lock:
+            dead = [sid for sid, entry in self._data.items() if entry[1] == user_id]
+            for sid in dead:
+                del self._data[sid]
+        return len(dead)
+
+    def sweep(self, now: float) -> int:
+        with self._lock:
+            dead = [sid for sid, entry in self._data.items() if entry[0] <= now]
+            for sid in dead:
+                del self._data[sid]
+        return len(dead)
+
+
+class SqliteSessionStore:
+    # sessions 表：多进程共享、重启不丢；过期记录由 sweep 分批删除，避免一次长事务
+    def __init__(self, db_path: Path, *, sweep_batch: int = 500) -> None:
+        self.db_path = db_path
+        self.sweep_batch = max(1, int(sweep_batch))
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _connect(str(self.db_path))
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid: str, now: float) -> tuple[str, float] | None:
+        row = self._conn().execute("SELECT data, expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None or float(row["expires"]) <= now:
+            return None
+        return row["data"], float(row["expires"])
+
+    def save(self, sid: str, user_id: int | None, data: str, expires: float) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO sessions (sid, user_id, data, expires) VALUES (?, ?, ?, ?)
+                ON CONFLICT(sid) DO UPDATE SET user_id = excluded.user_id, data = excluded.data, expires = excluded.expires
+                """,
+                (sid, user_id, data, expires),
+            )
+
+    def delete(self, sid: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def delete_user(self, user_id: int) -> int:
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,)).rowcount
+
+    def sweep(self, now: float) -> int:
+        total = 0
+        while True:
+            with self._conn() as conn:
+                n = conn.execute(
+                    "DELETE FROM sessions WHERE sid IN (SELECT sid FROM sessions WHERE expires <= ? LIMIT ?)",
+                    (now, self.sweep_batch),
+                ).rowcount
+            total += n
+            if n < self.sweep_batch:
+                return total
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, *, lifetime_seconds: float, sweep_interval: float = 60.0) -> None:
+        self.store = store
+        self.lifetime = max(60.0, float(lifetime_seconds))
+        self.sweep_interval = float(sweep_interval)
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def open_session(self, app, request) -> ServerSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID_RE.match(sid):
+            loaded = self.store.load(sid, time.time())
+            if loaded is not None:
+                data, expires = loaded
+                try:
+                    return ServerSession(self.serializer.loads(data), sid=sid, expires=expires)
+                except ValueError:
+                    pass
+        return ServerSession()
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = now
+            self.store.sweep(now)
+        finally:
+            self._sweep_lock.release()
+
+    def save_session(self, app, session: ServerSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+            if session.modified or session.sid:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        new_sid = session.sid is None
+        if new_sid:
+            session.sid = _new_sid()
+
+        # 滑动过期：数据未变化时只有剩余有效期不足一半才续期，避免每个请求都写一次
+        if new_sid or session.modified or session.expires - now < self.lifetime / 2:
+            user_id = session.get("user_id")
+            self.store.save(
+                session.sid,
+                int(user_id) if user_id else None,
+                self.serializer.dumps(dict(session)),
+                now + self.lifetime,
+            )
+            session.expires = now + self.lifetime
+            self._maybe_sweep(now)
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            partitioned=self.get_cookie_partitioned(app),
+        )
+
+
+def init_sessions(app) -> ServerSessionInterface | None:
+    backend = app.config["SESSION_BACKEND"]
+    if backend == "memory":
+        store = MemorySessionStore(max_entries=app.config["SESSION_MAX_ENTRIES"])
+    elif backend == "sqlite":
+        store = SqliteSessionStore(Path(app.config["DB_PATH"]))
+    else:
+        # cookie：Flask 默认的签名 cookie 会话
+        return None
+    interface = ServerSessionInterface(store, lifetime_seconds=app.config["SESSION_MINUTES"] * 60)
+    app.session_interface = interface
+    return interface
+
+
+def revoke_user_sessions(user_id: int) -> int:
+    interface = current_app.session_interface
+    if isinstance(interface, ServerSessionInterface):
+        return interface.store.delete_user(int(user_id))
+    return 0
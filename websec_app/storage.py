@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+from .thumbs import remove_thumbnails
+from .watermark import render_params_key
+
+# 内容寻址存储：原图按内容哈希命名，水印图按（原图, 水印文字, 渲染参数）的哈希命名。
+# 引用计数保存在 blob_refs 表，由 images 上的触发器维护；只有计数归零时才删除文件。
+#
+# 上传时“复用已有文件 + 插入记录”与回收时“检查计数 + 删除文件”需要互斥，避免刚被复用的文件被删掉。
+_lock = threading.RLock()
+
+
+def storage_lock() -> threading.RLock:
+    return _lock
+
+
+def original_name_for(sha256: str, suffix: str) -> str:
+    return f"{sha256}{suffix}"
+
+
+def watermarked_name_for(stored_name: str, text: str) -> str:
+    text = (text or "").strip() or "WATERMARK"
+    key = "\0".join([Path(stored_name).stem, text, render_params_key()])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest() + ".jpg"
+
+
+def collect_garbage(
+    conn: sqlite3.Connection,
+    upload_dir: Path,
+    watermarked_dir: Path,
+    *,
+    thumb_dir: Path | None = None,
+    stored_names: Iterable[str] = (),
+    watermarked_names: Iterable[str] = (),
+) -> int:
+    candidates = [(upload_dir, n) for n in set(stored_names)] + [(watermarked_dir, n) for n in set(watermarked_names)]
+    if not candidates:
+        return 0
+
+    with _lock:
+        names = [n for _d, n in candidates]
+        placeholders = ",".join("?" for _ in names)
+        refs = {
+            r[0]: int(r[1])
+            for r in conn.execute(f"SELECT name, refs FROM blob_refs WHERE name IN ({placeholders})", tuple(names))
+        }
+        dead = [(d, n) for d, n in candidates if refs.get(n, 0) <= 0]
+        if not dead:
+            return 0
+
+        placeholders = ",".join("?" for _ in dead)
+        conn.execute(f"DELETE FROM blob_refs WHERE name IN ({placeholders}) AND refs <= 0", tuple(n for _d, n in dead))
+        conn.commit()
+        for directory, name in dead:
+            try:
+                (directory / name).unlink(missing_ok=True)
+            except Exception:
+                pass
+            if thumb_dir is not None and directory == watermarked_dir:
+                remove_thumbnails(thumb_dir, name)
+    return len(dead)
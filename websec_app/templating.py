@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from pathlib import Path
+
+from flask import current_app, has_app_context
+from jinja2 import FileSystemBytecodeCache
+
+
+# 页面片段缓存（有界 LRU + TTL）：缓存渲染好的 HTML 片段，命中时连查询一起跳过。
+# 键中包含 (scope, user_id) 的数据版本号；该用户的数据变化时 bump() 使版本 +1，旧条目不再命中，由 LRU 自然淘汰。
+class FragmentCache:
+    def __init__(self, *, size: int = 512, ttl: float = 300.0) -> None:
+        self.size = max(1, int(size))
+        self.ttl = float(ttl)
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+        self._versions: dict[tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, scope: str, user_id: int, *parts: Hashable) -> tuple:
+        with self._lock:
+            version = self._versions.get((scope, user_id), 0)
+        return (scope, user_id, version, *parts)
+
+    def get(self, key: tuple):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now or self._versions.get((key[0], key[1]), 0) != key[2]:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: tuple, value) -> None:
+        with self._lock:
+            # 渲染期间数据已变化：不写回旧结果
+            if self._versions.get((key[0], key[1]), 0) != key[2]:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def bump(self, scope: str, user_id: int) -> None:
+        with self._lock:
+            self._versions[(scope, user_id)] = self._versions.get((scope, user_id), 0) + 1
+
+
+def get_fragment_cache() -> FragmentCache | None:
+    return current_app.extensions.get("fragment_cache")
+
+
+def fragment_key(scope: str, user_id: int, *parts: Hashable) -> tuple | None:
+    cache = get_fragment_cache()
+    return cache.key(scope, int(user_id), *parts) if cache is not None else None
+
+
+def bump_fragments(scope: str, user_id: int | None) -> None:
+    if user_id is None or not has_app_context():
+        return
+    cache = get_fragment_cache()
+    if cache is not None:
+        cache.bump(scope, int(user_id))
+
+
+def cached_fragment(key: tuple | None, render):
+    # render() 返回 (片段数据, 是否可缓存)；片段数据中的 HTML 应为 Markup
+    cache = get_fragment_cache()
+    if cache is not None and key is not None:
+        value = cache.get(key)
+        if value is not None:
+            return value
+    value, cacheable = render()
+    if cache is not None and key is not None and cacheable:
+        cache.set(key, value)
+    return value
+
+
+def init_templating(app) -> None:
+    # Jinja 编译结果写入 var/ 下的字节码缓存，新进程不必重新编译；启动时预加载全部模板
+    cache_dir = Path(app.config["TEMPLATE_CACHE_DIR"])
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(str(cache_dir))
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    if app.config["FRAGMENT_CACHE_SIZE"] <= 0:
+        return
+    cache = FragmentCache(size=app.config["FRAGMENT_CACHE_SIZE"], ttl=app.config["FRAGMENT_CACHE_TTL"])
+    app.extensions["fragment_cache"] = cache
+    # 批量重新生成在后台线程写回结果，完成时同样使该用户的图片列表片段失效
+    queue = app.extensions.get("watermark_queue")
+    if queue is not None:
+        queue.on_batch_done = lambda user_id: cache.bump("images", user_id)
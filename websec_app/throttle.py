@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import atexit
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from flask import current_app
+
+from .db import _connect
+
+_SWEEP_INTERVAL = 60.0
+
+
+# 令牌桶：每个 key 只保存 (剩余令牌, 上次更新时间) 两个浮点数。
+# 桶满（空闲足够久）的 key 与不存在等价，定期清理即可，内存只与“最近活跃的 key”数量相关。
+class TokenBuckets:
+    def __init__(self, *, capacity: float, per_minute: float, max_keys: int = 100_000) -> None:
+        self.capacity = max(1.0, float(capacity))
+        self.rate = max(0.0, float(per_minute)) / 60.0
+        self.max_keys = max(1, int(max_keys))
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def _level(self, key: str, now: float) -> float:
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.capacity
+        tokens, updated = entry
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def take(self, key: str, now: float | None = None) -> float:
+        # 成功返回 0；令牌不足时返回需要等待的秒数（不扣减）
+        now = time.time() if now is None else now
+        with self._lock:
+            if now - self._last_sweep >= _SWEEP_INTERVAL or len(self._buckets) >= self.max_keys:
+                self._sweep(now)
+            tokens = self._level(key, now)
+            if tokens < 1.0:
+                return (1.0 - tokens) / self.rate if self.rate else float("inf")
+            self._buckets[key] = (tokens - 1.0, now)
+            return 0.0
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        full = [k for k in self._buckets if self._level(k, now) >= self.capacity]
+        for k in full:
+            del self._buckets[k]
+        # 仍超出上限（大量不同 key 的攻击流量）：丢弃最早更新的一半
+        if len(self._buckets) >= self.max_keys:
+            oldest = sorted(self._buckets, key=lambda k: self._buckets[k][1])[: len(self._buckets) // 2]
+            for k in oldest:
+                del self._buckets[k]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def snapshot(self) -> list[tuple[str, float, float]]:
+        with self._lock:
+            return [(k, tokens, updated) for k, (tokens, updated) in self._buckets.items()]
+
+    def restore(self, rows: list[tuple[str, float, float]]) -> None:
+        with self._lock:
+            for key, tokens, updated in rows:
+                self._buckets[key] = (float(tokens), float(updated))
+
+
+# 登录限流：按来源 IP 与用户名各一个令牌桶，在查库、校验密码、写审计日志之前判断。
+# persist 时退出前把未满的桶写入 login_throttle 表，启动时读回（重启不会清空限流状态）。
+class LoginThrottle:
+    def __init__(
+        self,
+        *,
+        ip_burst: int,
+        ip_per_minute: float,
+        user_burst: int,
+        user_per_minute: float,
+        db_path: Path | None = None,
+    ) -> None:
+        self.by_ip = TokenBuckets(capacity=ip_burst, per_minute=ip_per_minute)
+        self.by_user = TokenBuckets(capacity=user_burst, per_minute=user_per_minute)
+        self.db_path = db_path
+        self.allowed = 0
+        self.rejected = 0
+
+    def check(self, ip: str, username: str) -> float:
+        # 返回 0 表示放行，否则为建议的 Retry-After 秒数
+        wait = self.by_ip.take(f"ip:{ip}")
+        if not wait and username:
+            wait = self.by_user.take(f"user:{username.lower()}")
+        if wait:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def succeeded(self, username: str) -> None:
+        self.by_user.reset(f"user:{username.lower()}")
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "ip_keys": len(self.by_ip),
+            "user_keys": len(self.by_user),
+        }
+
+    def load(self) -> None:
+        if self.db_path is None:
+            return
+        conn = _connect(str(self.db_path))
+        try:
+            rows = conn.execute("SELECT key, tokens, updated FROM login_throttle").fetchall()
+        except sqlite3.Error:
+            return
+        finally:
+            conn.close()
+        self.by_ip.restore([tuple(r) for r in rows if r[0].startswith("ip:")])
+        self.by_user.restore([tuple(r) for r in rows if r[0].startswith("user:")])
+
+    def save(self) -> None:
+        if self.db_path is None:
+            return
+        rows = self.by_ip.snapshot() + self.by_user.snapshot()
+        conn = _connect(str(self.db_path))
+        try:
+            with conn:
+                conn.execute("DELETE FROM login_throttle")
+                conn.executemany("INSERT INTO login_throttle (key, tokens, updated) VALUES (?, ?, ?)", rows)
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+
+
+def init_login_throttle(app) -> LoginThrottle | None:
+    if not app.config["LOGIN_THROTTLE"]:
+        return None
+    throttle = LoginThrottle(
+        ip_burst=app.config["LOGIN_IP_BURST"],
+        ip_per_minute=app.config["LOGIN_IP_PER_MINUTE"],
+        user_burst=app.config["LOGIN_USER_BURST"],
+        user_per_minute=app.config["LOGIN_USER_PER_MINUTE"],
+        db_path=Path(app.config["DB_PATH"]) if app.config["LOGIN_THROTTLE_PERSIST"] else None,
+    )
+    throttle.load()
+    atexit.register(throttle.save)
+    app.extensions["login_throttle"] = throttle
+    return throttle
+
+
+def get_login_throttle() -> LoginThrottle | None:
+    return current_app.extensions.get("login_throttle")
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image, features
+
+# 列表页缩略图（120px 宽，2x 屏 240px）与详情页中图（960px）
+THUMB_WIDTHS = (120, 240, 480, 960)
+
+_WEBP = features.check("webp")
+
+
+def snap_width(width: int) -> int:
+    for w in THUMB_WIDTHS:
+        if width <= w:
+            return w
+    return THUMB_WIDTHS[-1]
+
+
+def thumb_name(watermarked_name: str, width: int, fmt: str) -> str:
+    ext = "webp" if fmt == "webp" else "jpg"
+    return f"{Path(watermarked_name).stem}-w{width}.{ext}"
+
+
+def pick_format(accept_webp: bool) -> str:
+    return "webp" if accept_webp and _WEBP else "jpeg"
+
+
+def ensure_thumbnail(src: Path, thumb_dir: Path, watermarked_name: str, width: int, fmt: str) -> Path:
+    # 水印图按内容寻址命名，派生图名也随之不可变：生成一次后直接复用
+    dst = thumb_dir / thumb_name(watermarked_name, width, fmt)
+    if dst.exists():
+        return dst
+
+    with Image.open(src) as im:
+        # JPEG 可在解码阶段按 1/2、1/4、1/8 缩小，避免完整解码大图
+        im.draft("RGB", (width, max(1, im.size[1] * width // max(1, im.size[0]))))
+        im = im.convert("RGB")
+        if im.size[0] > width:
+            im.thumbnail((width, im.size[1] * width // im.size[0] or 1), Image.LANCZOS)
+
+        thumb_dir.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f".{os.getpid()}-{threading.get_ident()}-{dst.name}")
+        try:
+            if fmt == "webp":
+                im.save(tmp, "WEBP", quality=80, method=4)
+            else:
+                im.save(tmp, "JPEG", quality=82, optimize=True, progressive=True)
+            os.replace(tmp, dst)
+        finally:
+            tmp.unlink(missing_ok=True)
+    return dst
+
+
+def remove_thumbnails(thumb_dir: Path, watermarked_name: str) -> None:
+    stem = Path(watermarked_name).stem
+    for w in THUMB_WIDTHS:
+        for ext in ("jpg", "webp"):
+            try:
+                (thumb_dir / f"{stem}-w{w}.{ext}").unlink(missing_ok=True)
+            except Exception:
+                pass
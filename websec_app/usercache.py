@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from flask import current_app
+
+
+# 按用户 id 缓存 users 行（有界 LRU + TTL），省去每个请求一次的 SELECT。
+# 每个 id 带一个版本号：修改/删除用户时 invalidate() 使版本 +1，
+# 未命中时先记下版本再查库，写回前版本已变化则放弃写回，避免并发修改后缓存旧数据。
+class UserCache:
+    def __init__(self, *, size: int = 1024, ttl: float = 30.0) -> None:
+        self.size = max(0, int(size))
+        self.ttl = float(ttl)
+        self._rows: OrderedDict[int, tuple[float, int, dict | None]] = OrderedDict()
+        self._versions: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, load: Callable[[int], dict | None]) -> dict | None:
+        if self.size == 0:
+            return load(user_id)
+
+        now = time.monotonic()
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+            entry = self._rows.get(user_id)
+            if entry is not None and entry[0] > now and entry[1] == version:
+                self._rows.move_to_end(user_id)
+                self.hits += 1
+                row = entry[2]
+                return dict(row) if row is not None else None
+            self.misses += 1
+
+        row = load(user_id)
+        with self._lock:
+            if self._versions.get(user_id, 0) == version:
+                self._rows[user_id] = (now + self.ttl, version, dict(row) if row is not None else None)
+                self._rows.move_to_end(user_id)
+                while len(self._rows) > self.size:
+                    self._rows.popitem(last=False)
+        return row
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._rows.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            for user_id in list(self._rows):
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._rows.clear()
+
+
+def init_user_cache(app) -> UserCache:
+    cache = UserCache(size=app.config["USER_CACHE_SIZE"], ttl=app.config["USER_CACHE_TTL"])
+    app.extensions["user_cache"] = cache
+    return cache
+
+
+def get_user_cache() -> UserCache:
+    return current_app.extensions["user_cache"]
@@ -1,38 +1,131 @@
 from __future__ import annotations
 
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 
 from PIL import Image, ImageDraw, ImageFont
 
+# semi-transparent black background + white text
+_DEFAULT_STYLE = ((255, 255, 255, 230), (0, 0, 0, 110), 6)
 
-def add_text_watermark(src: Path, dst: Path, text: str) -> None:
-    text = (text or "").strip()
-    if not text:
-        text = "WATERMARK"
 
-    with Image.open(src) as im:
-        base = im.convert("RGBA")
-        overlay = Image.new("RGBA", base.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(overlay)
+@lru_cache(maxsize=16)
+def _load_font(font_path: str | None, font_size: float | None):
+    try:
+        if font_path:
+            return ImageFont.truetype(font_path, size=int(font_size or 16))
+        return ImageFont.load_default(size=font_size) if font_size else ImageFont.load_default()
+    except Exception:
+        return None
 
-        try:
-            font = ImageFont.load_default()
-        except Exception:
-            font = None
 
-        margin = max(10, int(min(base.size) * 0.02))
-        box = draw.textbbox((0, 0), text, font=font)
+# Reuses fonts and pre-rendered text patches (bounded LRU); only the corner region
+# covered by the patch is blended, no full-size RGBA overlay per image.
+class WatermarkRenderer:
+    def __init__(
+        self,
+        *,
+        font_path: str | None = None,
+        font_size: float | None = None,
+        style: tuple = _DEFAULT_STYLE,
+        cache_size: int = 128,
+        quality: int = 92,
+    ) -> None:
+        self.font_path = font_path
+        self.font_size = font_size
+        self.style = style
+        self.cache_size = max(1, int(cache_size))
+        self.quality = int(quality)
+        self._patches: OrderedDict[tuple, Image.Image] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def params_key(self) -> str:
+        # part of the content-addressed output name: changing params yields new files
+        return repr((self.font_path, self.font_size, self.style, self.quality))
+
+    def _patch(self, text: str) -> Image.Image:
+        key = (text, self.font_path, self.font_size, self.style)
+        with self._lock:
+            patch = self._patches.get(key)
+            if patch is not None:
+                self._patches.move_to_end(key)
+                return patch
+
+        fill, background, pad = self.style
+        font = _load_font(self.font_path, self.font_size)
+        box = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), text, font=font)
         text_w = box[2] - box[0]
         text_h = box[3] - box[1]
+
+        # patch origin is the top-left corner of the background box
+        width = max(text_w + 2 * pad + 1, pad + box[2])
+        height = max(text_h + 2 * pad + 1, pad + box[3])
+        patch = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(patch)
+        draw.rectangle([0, 0, text_w + 2 * pad, text_h + 2 * pad], fill=background)
+        draw.text((pad, pad), text, fill=fill, font=font)
+        patch.info["text_size"] = (text_w, text_h)
+
+        with self._lock:
+            self._patches[key] = patch
+            self._patches.move_to_end(key)
+            while len(self._patches) > self.cache_size:
+                self._patches.popitem(last=False)
+        return patch
+
+    def render(self, src: Path, dst: Path, text: str) -> None:
+        text = (text or "").strip()
+        if not text:
+            text = "WATERMARK"
+
+        patch = self._patch(text)
+        text_w, text_h = patch.info["text_size"]
+        pad = self.style[2]
+
+        with Image.open(src) as im:
+            has_alpha = im.mode in ("RGBA", "LA", "PA", "RGBa", "La") or "transparency" in im.info
+            rgba = im.convert("RGBA") if has_alpha else None
+            base = (rgba or im).convert("RGB")
+
+        margin = max(10, int(min(base.size) * 0.02))
         x = base.size[0] - text_w - margin
         y = base.size[1] - text_h - margin
+        origin = (x - pad, y - pad)
 
-        # semi-transparent black background + white text
-        pad = 6
-        draw.rectangle([x - pad, y - pad, x + text_w + pad, y + text_h + pad], fill=(0, 0, 0, 110))
-        draw.text((x, y), text, fill=(255, 255, 255, 230), font=font)
+        if rgba is None:
+            # paste() clips to the frame and blends with the patch alpha as mask,
+            # which matches alpha_composite over an opaque base
+            base.paste(patch, origin, patch)
+        else:
+            # transparent source: blending must see the source alpha, as alpha_composite
+            # over the RGBA frame did; composite only the patch-sized region and paste it back
+            region = rgba.crop((origin[0], origin[1], origin[0] + patch.width, origin[1] + patch.height))
+            base.paste(Image.alpha_composite(region, patch).convert("RGB"), origin)
 
-        out = Image.alpha_composite(base, overlay).convert("RGB")
+        # write-then-rename: concurrent renders of the same content-addressed name never
+        # expose a half-written file, and a failed render leaves nothing behind
         dst.parent.mkdir(parents=True, exist_ok=True)
-        out.save(dst, quality=92)
+        tmp = dst.with_name(f".{os.getpid()}-{threading.get_ident()}-{dst.name}")
+        try:
+            base.save(tmp, quality=self.quality)
+            os.replace(tmp, dst)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+
+_default_renderer = WatermarkRenderer()
+
+
+def add_text_watermark(src: Path, dst: Path, text: str) -> float:
+    # returns the render time in seconds (the caller may be in another process)
+    start = time.perf_counter()
+    _default_renderer.render(src, dst, text)
+    return time.perf_counter() - start
+
 
+def render_params_key() -> str:
+    return _default_renderer.params_key()